@@ -13,7 +13,7 @@ if %ERRORLEVEL% NEQ 0 (
 )
 
 echo Python found. Installing required libraries...
-python -m pip install spotipy python-dotenv
+python -m pip install spotipy python-dotenv yt-dlp
 if %ERRORLEVEL% NEQ 0 (
     echo Error: Failed to install libraries. Ensure you have internet and pip is working.
     pause
@@ -0,0 +1,372 @@
+# spotify_to_youtube_benchmark.py
+# Description: Offline throughput benchmark for the download engine. Uses a fake Spotify client and a stub
+#              downloader that simulates YouTube search/download latency and writes dummy files, so it needs
+#              no credentials, network access, yt-dlp or ffmpeg.
+# Usage:
+#   python spotify_to_youtube_benchmark.py [--fetch-sizes 100 1000 10000 50000] [--download-sizes 100 1000]
+#                                          [--page-latency 0.05] [--search-latency 0.05] [--download-latency 0.1]
+#                                          [--workers 8] [--keep-rate-limits] [--save-baseline]
+#                                          [--startup-runs 5] [--startup-target 0.5]
+# Every scenario runs in its own child process (and temporary folder), so peak memory is measured per scenario.
+# Results are compared with the saved baseline; a slowdown or memory growth beyond --tolerance exits with code 1.
+# Cold start (a fresh interpreter launching the CLI, and importing the GUI) is measured too and must stay
+# under --startup-target seconds. A few fixed search results are also run through the candidate ranking first;
+# a wrong pick counts as a regression.
+# Requirements: see spotify_to_youtube_core.py (psutil is used for peak memory on Windows if installed).
+
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import tempfile
+import importlib.util
+import threading
+import subprocess
+import spotify_to_youtube_core as core
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_FETCH_SIZES = (100, 1000, 10000, 50000)
+DEFAULT_DOWNLOAD_SIZES = (100, 1000)
+DEFAULT_TOLERANCE = 0.2  # Allowed relative drop in throughput (or growth in memory) before flagging a regression
+GUI_POLL_INTERVAL = 0.1  # Matches the GUI's queue poll interval
+BENCHMARK_PLAYLIST_ID = "benchmark"
+STARTUP_RUNS = 5  # Launches per cold start measurement; the median is reported
+STARTUP_TARGET_SECONDS = 0.5  # Budget for starting the CLI or loading the GUI, for scripts that launch the tool often
+
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+
+# --- Candidate Ranking Checks ---
+RANKING_TRACK = {'id': "rhapsody", 'artist': "Queen", 'name': "Bohemian Rhapsody", 'duration_ms': 354000}
+OFFICIAL = {'video_id': "official", 'title': "Queen – Bohemian Rhapsody (Official Video Remastered)", 'uploader': "Queen Official", 'duration': 359}
+LIVE = {'video_id': "live", 'title': "Queen - Bohemian Rhapsody (Live at Wembley Stadium)", 'uploader': "Queen Official", 'duration': 372}
+LOOP = {'video_id': "loop", 'title': "Bohemian Rhapsody 1 hour loop", 'uploader': "Loops", 'duration': 3600}
+UNRELATED = {'video_id': "cats", 'title': "Cat compilation funny", 'uploader': "Cats", 'duration': 354}
+EXTENDED = {'video_id': "extended", 'title': "Queen Bohemian Rhapsody", 'uploader': "Fan uploads", 'duration': 600}
+# (description, track, search results, expected video ID or None if the track should be flagged as ambiguous)
+RANKING_CHECKS = [
+    ("official upload beats live version and loop", RANKING_TRACK, [LIVE, LOOP, OFFICIAL], "official"),
+    ("same length but unrelated title", RANKING_TRACK, [UNRELATED], None),
+    ("only a live version", RANKING_TRACK, [LIVE], None),
+    ("only a 1 hour loop", RANKING_TRACK, [LOOP], None),
+    ("equal titles with different lengths and no Spotify duration", dict(RANKING_TRACK, duration_ms=None), [OFFICIAL, EXTENDED], None),
+]
+
+def check_ranking():
+    """Runs RANKING_CHECKS through core.choose_candidate and returns a description of every wrong pick."""
+    failures = []
+    for description, track, candidates, expected in RANKING_CHECKS:
+        try:
+            chosen = core.choose_candidate(track, candidates)['video_id']
+        except core.AmbiguousMatchError:
+            chosen = None
+        if chosen != expected:
+            failures.append(f"candidate ranking, {description}: picked {chosen or 'nothing'} (expected {expected or 'nothing'})")
+    return failures
+
+# --- Fakes ---
+class FakeSpotify:
+    """Stand-in for spotipy.Spotify that serves a generated playlist with a fixed latency per request."""
+
+    def __init__(self, size, page_latency):
+        self.size = size
+        self.page_latency = page_latency
+
+    def playlist(self, playlist_id, fields=None):
+        time.sleep(self.page_latency)
+        return {'name': f"Benchmark {self.size}", 'snapshot_id': f"benchmark-{self.size}"}
+
+    def playlist_items(self, playlist_id, fields=None, limit=core.PAGE_SIZE, offset=0):
+        time.sleep(self.page_latency)
+        return self.page(offset, limit)
+
+    def next(self, result):
+        time.sleep(self.page_latency)
+        return self.page(result['offset'] + result['limit'], result['limit']) if result['next'] else None
+
+    def page(self, offset, limit):
+        items = [{'track': {
+            'id': f"bench{i:07d}",
+            'name': f"Track {i}",
+            'artists': [{'name': f"Artist {i % 500}"}],
+            'duration_ms': 150000 + (i * 7919) % 120000,
+            'external_ids': {'isrc': f"BENCH{i:07d}"},
+        }} for i in range(offset, min(offset + limit, self.size))]
+        has_next = offset + limit < self.size
+        return {'items': items, 'offset': offset, 'limit': limit, 'total': self.size,
+                'next': f"fake://playlist/{BENCHMARK_PLAYLIST_ID}/tracks?offset={offset + limit}" if has_next else None}
+
+class StubDownloader(core.BaseDownloader):
+    """Pretends to search and download with fixed latencies and writes a dummy audio file."""
+    name = "stub"
+    supports_search = True
+
+    def __init__(self, search_latency, download_latency, file_size):
+        self.search_latency = search_latency
+        self.download_latency = download_latency
+        self.file_size = file_size
+        self.payload = b"\0" * file_size
+        self.first_download = None
+        self.lock = threading.Lock()
+
+    def search(self, query, count):
+        time.sleep(self.search_latency)
+        # No duration, so candidates are ranked by title only (the query itself always matches).
+        return [{'video_id': f"stub{sum(query.encode()) % 10**8:08d}{i}", 'title': query, 'uploader': "Stub", 'duration': None}
+                for i in range(count)]
+
+    def download(self, source, output_path_template, audio_format="mp3"):
+        if source.startswith("ytsearch"):
+            time.sleep(self.search_latency)
+        time.sleep(self.download_latency)
+        ext = {"mp3": "mp3", "best": "m4a"}.get(audio_format, "webm")
+        filepath = output_path_template.replace("%(ext)s", ext)
+        with open(filepath, 'wb') as f:
+            f.write(self.payload)
+        with self.lock:
+            if self.first_download is None:
+                self.first_download = time.perf_counter()
+        return {
+            'confirmed': True,
+            'filepath': filepath,
+            'video_id': f"stub{sum(source.encode()) % 10**8:08d}",
+            'title': source,
+            'details': [],
+            'download_seconds': self.download_latency,
+        }
+
+class TimestampedQueue(queue.Queue):
+    """Engine message queue that remembers when each message was put, to measure how long the GUI would lag."""
+
+    def put(self, item, block=True, timeout=None):
+        super().put((time.perf_counter(), item), block, timeout)
+
+def consume_like_gui(msg_queue, latencies, stop_event):
+    """Drains the queue every GUI_POLL_INTERVAL, as the GUI's check_queue does, recording message latency."""
+    while True:
+        stopping = stop_event.is_set()
+        now = time.perf_counter()
+        try:
+            while True:
+                put_time, _ = msg_queue.get_nowait()
+                latencies.append(now - put_time)
+        except queue.Empty:
+            pass
+        if stopping:
+            return
+        time.sleep(GUI_POLL_INTERVAL)
+
+# --- Measurement ---
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None if it can't be measured here."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except (ImportError, AttributeError):
+        return None
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run_fetch_scenario(options):
+    engine = core.DownloadEngine(FakeSpotify(options['size'], options['page_latency']), queue.Queue())
+    started = time.perf_counter()
+    tracks = engine.get_playlist_tracks(BENCHMARK_PLAYLIST_ID)
+    seconds = time.perf_counter() - started
+    return {'tracks': len(tracks), 'seconds': round(seconds, 3), 'tracks_per_second': round(len(tracks) / seconds, 1)}
+
+def run_download_scenario(options):
+    msg_queue = TimestampedQueue()
+    downloader = StubDownloader(options['search_latency'], options['download_latency'], options['file_size'])
+    engine = core.DownloadEngine(FakeSpotify(options['size'], options['page_latency']), msg_queue)
+    engine.downloader_factory = lambda backend: downloader
+
+    latencies = []
+    stop_event = threading.Event()
+    consumer = threading.Thread(target=consume_like_gui, args=(msg_queue, latencies, stop_event), daemon=True)
+    consumer.start()
+    started = time.perf_counter()
+    success = engine.run_download_process(BENCHMARK_PLAYLIST_ID, core.SEARCH_SUFFIX_LYRICS, options['workers'],
+                                          output_format=core.OUTPUT_NATIVE)
+    seconds = time.perf_counter() - started
+    stop_event.set()
+    consumer.join()
+
+    return {
+        'success': success,
+        'tracks': options['size'],
+        'seconds': round(seconds, 3),
+        'tracks_per_second': round(options['size'] / seconds, 1),
+        'time_to_first_download': round(downloader.first_download - started, 3) if downloader.first_download else None,
+        'queue_messages': len(latencies),
+        'queue_latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        'queue_latency_p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        'queue_latency_max_ms': round(max(latencies) * 1000, 1) if latencies else None,
+    }
+
+def run_child(options):
+    """Runs one scenario inside a temporary folder and prints its result as JSON."""
+    if not options['keep_rate_limits']:
+        # The fakes are local, so the limits meant to protect Spotify and YouTube would only measure the limiter itself.
+        core.YOUTUBE_REQUESTS_PER_SECOND = core.YOUTUBE_MAX_REQUESTS_PER_SECOND = 1e6
+        core.SPOTIFY_REQUESTS_PER_SECOND = core.SPOTIFY_MAX_REQUESTS_PER_SECOND = 1e6
+    original_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="spotify_benchmark_")
+    os.chdir(work_dir)
+    try:
+        if options['kind'] == "fetch":
+            result = run_fetch_scenario(options)
+        else:
+            result = run_download_scenario(options)
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    result['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(result))
+
+def run_scenario(options):
+    command = [sys.executable, os.path.abspath(__file__), "--child", json.dumps(options)]
+    completed = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    if completed.returncode != 0:
+        raise RuntimeError(f"Scenario {options['name']} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def startup_commands():
+    """Returns the cold start commands to measure: the CLI up to argument parsing, and the GUI module import."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    commands = {'startup-cli': [sys.executable, os.path.join(directory, "spotify_to_youtube_cli.py"), "--help"]}
+    if importlib.util.find_spec("tkinter"):
+        commands['startup-gui'] = [sys.executable, "-c", f"import sys; sys.path.insert(0, {directory!r}); import spotify_to_youtube_gui"]
+    return commands
+
+def measure_startup(command, runs):
+    """Returns the median and maximum wall time of running command in a fresh interpreter (and empty folder)."""
+    work_dir = tempfile.mkdtemp(prefix="spotify_benchmark_")
+    times = []
+    try:
+        for _ in range(runs):
+            started = time.perf_counter()
+            completed = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore', cwd=work_dir)
+            times.append(time.perf_counter() - started)
+            if completed.returncode != 0:
+                raise RuntimeError(f"Startup command failed:\n{completed.stderr[-2000:]}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'seconds': round(percentile(times, 0.5), 3), 'max_seconds': round(max(times), 3)}
+
+# --- Baseline ---
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'created': time.strftime("%Y-%m-%d %H:%M:%S"), 'python': sys.version.split()[0], 'results': results}, f, indent=2)
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regression descriptions against the baseline results."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline['results'].get(name)
+        if not previous:
+            continue
+        if result['tracks_per_second'] < previous['tracks_per_second'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['tracks_per_second']} tracks/s (baseline {previous['tracks_per_second']})")
+        if result.get('peak_rss_mb') and previous.get('peak_rss_mb') and result['peak_rss_mb'] > previous['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak memory {result['peak_rss_mb']} MB (baseline {previous['peak_rss_mb']} MB)")
+    return regressions
+
+def format_result(name, result):
+    text = f"{name:<16} {result['tracks']:>6} tracks  {result['seconds']:>8.2f}s  {result['tracks_per_second']:>8.1f} tracks/s"
+    text += f"  peak {result['peak_rss_mb']} MB"
+    if 'time_to_first_download' in result:
+        text += f"  first download {result['time_to_first_download']}s"
+        text += f"  queue latency p50/p95/max {result['queue_latency_p50_ms']}/{result['queue_latency_p95_ms']}/{result['queue_latency_max_ms']} ms"
+    return text
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for the Spotify playlist downloader engine.")
+    parser.add_argument("--fetch-sizes", type=int, nargs="*", default=list(DEFAULT_FETCH_SIZES), metavar="N",
+                        help="playlist sizes for the track listing benchmark")
+    parser.add_argument("--download-sizes", type=int, nargs="*", default=list(DEFAULT_DOWNLOAD_SIZES), metavar="N",
+                        help="playlist sizes for the full download benchmark")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="seconds per fake Spotify API request")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="seconds per simulated YouTube search")
+    parser.add_argument("--download-latency", type=float, default=0.1, help="seconds per simulated download")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="bytes written per dummy audio file")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="parallel downloads")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="keep the Spotify/YouTube rate limits (off by default, the fakes are local)")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help=f"baseline results file (default {BASELINE_FILE})")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed relative slowdown before flagging a regression")
+    parser.add_argument("--startup-runs", type=int, default=STARTUP_RUNS, metavar="N", help="launches per cold start measurement (0 = skip)")
+    parser.add_argument("--startup-target", type=float, default=STARTUP_TARGET_SECONDS, metavar="SECONDS",
+                        help=f"maximum median cold start time (default {STARTUP_TARGET_SECONDS}s)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser
+
+# --- Main Execution ---
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.child:
+        run_child(json.loads(args.child))
+        return EXIT_OK
+
+    common = {'page_latency': args.page_latency, 'search_latency': args.search_latency, 'download_latency': args.download_latency,
+              'file_size': args.file_size, 'workers': args.workers, 'keep_rate_limits': args.keep_rate_limits}
+    scenarios = [dict(common, kind="fetch", name=f"fetch-{size}", size=size) for size in args.fetch_sizes]
+    scenarios += [dict(common, kind="download", name=f"download-{size}", size=size) for size in args.download_sizes]
+
+    ranking_failures = check_ranking()
+    for failure in ranking_failures:
+        print(f"REGRESSION {failure}")
+
+    results = {}
+    for options in scenarios:
+        results[options['name']] = run_scenario(options)
+        print(format_result(options['name'], results[options['name']]), flush=True)
+
+    slow_starts = []
+    for name, command in (startup_commands().items() if args.startup_runs > 0 else ()):
+        startup = measure_startup(command, args.startup_runs)
+        print(f"{name:<16} median {startup['seconds']:.3f}s  max {startup['max_seconds']:.3f}s  (target {args.startup_target}s)", flush=True)
+        if startup['seconds'] > args.startup_target:
+            slow_starts.append(f"{name}: cold start {startup['seconds']}s (target {args.startup_target}s)")
+    for slow_start in slow_starts:
+        print(f"REGRESSION {slow_start}")
+    check_failures = ranking_failures + slow_starts
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Baseline saved to '{args.baseline}'.")
+        return EXIT_REGRESSION if check_failures else EXIT_OK
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"No baseline found at '{args.baseline}'. Run with --save-baseline to create one.")
+        return EXIT_REGRESSION if check_failures else EXIT_OK
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions against the baseline from {baseline['created']}.")
+    return EXIT_REGRESSION if regressions or check_failures else EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
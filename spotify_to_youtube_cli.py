@@ -0,0 +1,211 @@
+# spotify_to_youtube_cli.py
+# Description: Command line / batch front end for the Spotify playlist downloader. Runs without Tkinter,
+#              so it can be used on headless machines and from scripts.
+# Usage:
+#   python spotify_to_youtube_cli.py URL[@PRIORITY] [URL ...] [--file urls.txt] [--workers 4] [--engine auto]
+#                                    [--instrumental] [--sync [--prune]] [--retry-failed] [--no-batch] [--jsonl]
+#                                    [--metrics-dir DIR | --no-metrics]
+#   Several playlists (or a profile URL, for all of that user's public playlists) run as one batch:
+#   songs they share are downloaded once, and playlists take turns in proportion to their priority.
+# Exit codes: 0 = every playlist finished without errors, 1 = at least one track or playlist failed,
+#             2 = invalid arguments or missing Spotify credentials.
+# Requirements: see spotify_to_youtube_core.py (python-dotenv is optional here; CLIENT_ID and
+#               CLIENT_SECRET can also be set as environment variables).
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from spotify_to_youtube_core import (
+    DEFAULT_BACKEND, DEFAULT_MAX_WORKERS, DEFAULT_OUTPUT_FORMAT, DOWNLOADER_BACKENDS, ENV_FILE, MAX_WORKERS_LIMIT, OUTPUT_FORMATS,
+    SEARCH_SUFFIX_INSTRUMENTAL, SEARCH_SUFFIX_LYRICS,
+    DownloadEngine, create_spotify_client, extract_playlist_id, extract_user_id, is_valid_credential,
+)
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+# --- Output ---
+class TextReporter:
+    """Prints log messages as plain text. Status updates are only shown with --verbose."""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.playlist = None
+        self.lock = threading.Lock()
+
+    def put(self, message):
+        message_type, data = message
+        with self.lock:
+            if message_type == "log":
+                print(data, flush=True)
+            elif message_type == "status" and self.verbose:
+                print(f"[status] {data}", file=sys.stderr, flush=True)
+
+class JsonLinesReporter:
+    """Writes every engine message as one JSON object per line on stdout."""
+
+    def __init__(self):
+        self.playlist = None
+        self.lock = threading.Lock()
+
+    def put(self, message):
+        message_type, data = message
+        event = {'time': round(time.time(), 3), 'playlist': self.playlist, 'type': message_type, 'data': data}
+        with self.lock:
+            sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+
+# --- Helper Functions ---
+def parse_playlist_arg(value):
+    """Accepts a playlist URL, a spotify:playlist: URI or a bare playlist ID."""
+    value = value.strip()
+    playlist_id = extract_playlist_id(value.replace("spotify:playlist:", "playlist/"))
+    if playlist_id:
+        return playlist_id
+    if value.isalnum():
+        return value
+    return None
+
+def parse_source_arg(value):
+    """Accepts a playlist (see parse_playlist_arg) or a user profile URL/URI, optionally followed by @PRIORITY.
+
+    Returns (playlist_id, user_id, priority) with one of the IDs set, or None if the value is not recognized.
+    """
+    value, _, priority = value.strip().partition("@")
+    if priority and not priority.isdigit():
+        return None
+    priority = int(priority) if priority else 1
+    playlist_id = parse_playlist_arg(value)
+    if playlist_id:
+        return playlist_id, None, priority
+    user_id = extract_user_id(value)
+    if user_id:
+        return None, user_id, priority
+    return None
+
+def run_in_thread(engine, function, *args):
+    """Runs an engine method in a worker thread so Ctrl+C can cancel it cleanly from the main thread."""
+    result = {}
+    run_thread = threading.Thread(target=lambda: result.update(success=function(*args)), daemon=True)
+    run_thread.start()
+    try:
+        while run_thread.is_alive():
+            run_thread.join(0.5)
+    except KeyboardInterrupt:
+        print("Cancelling... waiting for active downloads to finish.", file=sys.stderr, flush=True)
+        engine.cancel_event.set()
+        run_thread.join()
+    return result.get('success')
+
+def read_url_file(path):
+    """Reads playlist URLs from a file ('-' for stdin), one per line. Blank lines and lines starting with # are ignored."""
+    if path == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+def load_credentials():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=ENV_FILE)
+    except ImportError:
+        pass
+    return os.getenv("CLIENT_ID"), os.getenv("CLIENT_SECRET")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Download Spotify playlists as MP3 files using YouTube, without the GUI.")
+    parser.add_argument("playlists", nargs="*", metavar="URL",
+                        help="Spotify playlist URL, URI or ID, or a profile URL for all of that user's public playlists; append @N to set a priority")
+    parser.add_argument("-f", "--file", action="append", default=[], help="file with one playlist URL per line (can be repeated, '-' reads stdin)")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_MAX_WORKERS, help=f"parallel downloads (1-{MAX_WORKERS_LIMIT}, default {DEFAULT_MAX_WORKERS})")
+    parser.add_argument("-e", "--engine", choices=DOWNLOADER_BACKENDS, default=DEFAULT_BACKEND, help=f"download engine (default {DEFAULT_BACKEND})")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT,
+                        help="mp3 = convert (default), native = keep the downloaded file, remux = copy the audio into its own container without re-encoding")
+    parser.add_argument("--instrumental", action="store_true", help="search without appending 'lyrics'")
+    parser.add_argument("--sync", action="store_true", help="only download songs added since the last sync")
+    parser.add_argument("--prune", action="store_true", help="with --sync, delete songs no longer in the playlist")
+    parser.add_argument("--retry-failed", action="store_true", help="only retry the songs that failed in the previous run of each playlist")
+    parser.add_argument("--no-batch", action="store_true", help="download several playlists one after another instead of as one batch")
+    parser.add_argument("--transcode-workers", type=int, default=None, metavar="N",
+                        help="ffmpeg processes converting to MP3 (default: one per CPU core, 0 = let yt-dlp convert inside each download)")
+    parser.add_argument("--no-store", action="store_true", help="download into each playlist folder instead of linking from the shared store")
+    parser.add_argument("--metrics-dir", metavar="DIR", help="folder for metrics.jsonl and metrics.prom (default: current folder), "
+                                                              "e.g. node_exporter's textfile collector directory")
+    parser.add_argument("--no-metrics", action="store_true", help="don't time the pipeline stages or write metrics files")
+    parser.add_argument("--jsonl", action="store_true", help="write progress as JSON lines on stdout")
+    parser.add_argument("-v", "--verbose", action="store_true", help="also print status updates (text mode)")
+    return parser
+
+# --- Main Execution ---
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_intermixed_args(argv)  # URLs may come after options, e.g. "URL1 --sync URL2"
+
+    urls = list(args.playlists)
+    for path in args.file:
+        try:
+            urls.extend(read_url_file(path))
+        except OSError as e:
+            parser.error(f"could not read {path}: {e}")
+    if not urls:
+        parser.error("no playlist URLs given")
+    if args.prune and not args.sync:
+        parser.error("--prune requires --sync")
+    if args.no_metrics and args.metrics_dir:
+        parser.error("--metrics-dir can't be combined with --no-metrics")
+
+    playlists, user_ids = [], []
+    for url in urls:
+        source = parse_source_arg(url)
+        if not source:
+            parser.error(f"not a valid Spotify playlist or profile URL: {url}")
+        playlist_id, user_id, priority = source
+        if playlist_id:
+            playlists.append((playlist_id, priority))
+        else:
+            user_ids.append(user_id)
+    batch = (len(playlists) > 1 or user_ids) and not args.no_batch
+    if user_ids and not batch:
+        parser.error("profile URLs can only be downloaded as a batch")
+    if batch and args.retry_failed:
+        parser.error("--retry-failed works per playlist; combine it with --no-batch")
+
+    client_id, client_secret = load_credentials()
+    if not is_valid_credential(client_id) or not is_valid_credential(client_secret):
+        print(f"Error: CLIENT_ID and CLIENT_SECRET must be set in the environment or in {ENV_FILE}.", file=sys.stderr)
+        return EXIT_USAGE
+
+    reporter = JsonLinesReporter() if args.jsonl else TextReporter(args.verbose)
+    engine = DownloadEngine(create_spotify_client(client_id, client_secret), reporter)
+    engine.use_content_store = not args.no_store
+    engine.collect_metrics = not args.no_metrics
+    if args.metrics_dir:
+        engine.metrics_dir = args.metrics_dir
+    if args.transcode_workers is not None:
+        engine.split_transcode = args.transcode_workers > 0
+        engine.transcode_workers = args.transcode_workers or None
+    workers = max(1, min(args.workers, MAX_WORKERS_LIMIT))
+    search_suffix = SEARCH_SUFFIX_INSTRUMENTAL if args.instrumental else SEARCH_SUFFIX_LYRICS
+
+    failed_playlists = 0
+    if batch and not run_in_thread(engine, engine.run_batch, playlists, search_suffix, workers, args.engine, args.sync,
+                                   args.prune, args.format, user_ids):
+        failed_playlists += 1
+    for playlist_id, _ in ([] if batch else playlists):
+        if engine.cancel_event.is_set():
+            break
+        reporter.playlist = playlist_id
+        if not run_in_thread(engine, engine.run_download_process, playlist_id, search_suffix, workers, args.engine, args.sync,
+                             args.prune, args.format, args.retry_failed):
+            failed_playlists += 1
+
+    return EXIT_FAILED if failed_playlists or engine.cancel_event.is_set() else EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
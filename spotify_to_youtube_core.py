@@ -0,0 +1,2255 @@
+# spotify_to_youtube_core.py
+# Description: GUI-independent engine that fetches Spotify playlists and downloads the songs from YouTube with yt-dlp.
+# Used by both the Tkinter GUI (spotify_to_youtube_gui.py) and the command line (spotify_to_youtube_cli.py).
+# Requirements:
+#   - Python 3.x
+#   - spotipy library, 2.19 or newer (install using: pip install spotipy)
+#   - yt-dlp (either the yt-dlp Python package for the in-process engine, install using: pip install yt-dlp,
+#     or yt-dlp.exe in the system PATH or the same directory as this script)
+#   - ffmpeg (required by yt-dlp for audio conversion, should be in PATH or same directory)
+
+import os
+import sys
+import subprocess
+import sqlite3
+import json
+import hashlib
+import shutil
+import time
+import re
+import unicodedata
+import random
+import threading
+import queue
+import collections
+import itertools
+import heapq
+import concurrent.futures
+
+# --- Configuration ---
+BASE_OUTPUT_DIR = "Spotify_Downloads"
+ENV_FILE = ".env"
+TOKEN_CACHE_FILE = ".spotify_token"  # Client credentials token, reused by later launches until it expires
+PLACEHOLDER_VALUES = {None, "", "YOUR_SPOTIFY_CLIENT_ID_HERE", "YOUR_SPOTIFY_CLIENT_SECRET_HERE", "your_key_here"}
+SEARCH_SUFFIX_LYRICS = " lyrics"
+SEARCH_SUFFIX_INSTRUMENTAL = ""
+DEFAULT_SEARCH_SUFFIX = SEARCH_SUFFIX_LYRICS
+DEFAULT_MAX_WORKERS = 4  # Number of tracks downloaded in parallel
+MAX_WORKERS_LIMIT = 16
+TRACK_BUFFER_SIZE = 200  # Max fetched tracks waiting for a download worker
+PAGE_SIZE = 100  # Maximum page size allowed by the playlist items endpoint
+PARALLEL_PAGE_FETCH = True  # Fetch playlist pages concurrently by offset instead of following 'next' links
+PAGE_FETCH_WORKERS = 4
+RETRY_ATTEMPTS = 4  # Retries for throttled or transient Spotify/YouTube failures
+RETRY_BASE_DELAY = 0.5  # Seconds, doubled (with jitter) after every failed attempt
+RETRY_MAX_DELAY = 60
+MIN_REQUESTS_PER_SECOND = 0.2
+SPOTIFY_REQUESTS_PER_SECOND = 5  # Starting rate; grows while responses stay healthy
+SPOTIFY_MAX_REQUESTS_PER_SECOND = 30
+YOUTUBE_REQUESTS_PER_SECOND = 2
+YOUTUBE_MAX_REQUESTS_PER_SECOND = 10
+YOUTUBE_THROTTLE_PAUSE = 30  # Seconds to pause all downloads after YouTube answers 429
+PLAYLIST_ITEM_FIELDS = 'items(track(id, name, duration_ms, artists(name), external_ids(isrc))), next, total'
+YT_DLP_EXECUTABLE = "yt-dlp.exe"
+FFMPEG_EXECUTABLE = "ffmpeg.exe"
+BACKEND_AUTO = "auto"
+BACKEND_IN_PROCESS = "in-process"
+BACKEND_SUBPROCESS = "yt-dlp.exe"
+DOWNLOADER_BACKENDS = (BACKEND_AUTO, BACKEND_IN_PROCESS, BACKEND_SUBPROCESS)
+DEFAULT_BACKEND = BACKEND_AUTO
+YOUTUBE_VIDEO_URL = "https://www.youtube.com/watch?v={video_id}"
+USE_RESOLUTION_CACHE = True  # Reuse earlier Spotify track -> YouTube video matches instead of searching again
+RESOLUTION_CACHE_FILE = "resolution_cache.db"
+RESOLUTION_CACHE_TTL = 30 * 24 * 60 * 60  # Seconds before a cached match is searched again
+RESOLUTION_CACHE_MAX_ENTRIES = 100000
+RESOLUTION_CACHE_EVICT_INTERVAL = 500  # Run LRU eviction after this many new entries
+MANIFEST_FILENAME = ".spotify_manifest.json"  # Written into each playlist folder in sync mode
+USE_CONTENT_STORE = True  # Keep one copy of each track and link it into every playlist folder
+CONTENT_STORE_DIR = os.path.join(BASE_OUTPUT_DIR, ".store")
+USE_JOURNAL = True  # Record per-track progress so an interrupted run can resume
+JOURNAL_FILENAME = ".spotify_journal.jsonl"
+COLLECT_METRICS = True  # Time every pipeline stage and export the results
+METRICS_DIR = ""  # Folder for the metrics files ("" = current folder), e.g. node_exporter's textfile collector directory
+METRICS_JSONL_FILE = "metrics.jsonl"  # One JSON line per timed event, appended across runs
+METRICS_JSONL_MAX_BYTES = 5 * 1024 * 1024  # Rotated to metrics.jsonl.1, .2, ... once it grows past this
+METRICS_JSONL_BACKUPS = 3
+METRICS_PROM_FILE = "metrics.prom"  # Prometheus text format, rewritten while a run progresses
+METRICS_EXPORT_INTERVAL = 10  # Seconds between Prometheus file updates
+OUTPUT_MP3 = "mp3"  # Convert to MP3 (lossy re-encode)
+OUTPUT_NATIVE = "native"  # Keep the downloaded file as-is, no ffmpeg at all
+OUTPUT_REMUX = "remux"  # Copy the audio stream into a plain audio container (e.g. .opus, .m4a) without re-encoding
+OUTPUT_FORMATS = (OUTPUT_MP3, OUTPUT_NATIVE, OUTPUT_REMUX)
+DEFAULT_OUTPUT_FORMAT = OUTPUT_MP3
+AUDIO_EXTENSIONS = ("mp3", "opus", "m4a", "webm", "ogg", "aac", "flac", "wav", "mka")
+SPLIT_TRANSCODE = True  # Download native audio and convert it to MP3 in a separate, CPU-sized stage
+TRANSCODE_WORKERS = None  # None = one ffmpeg process per CPU core
+TRANSCODE_BUFFER_SIZE = 16  # Max downloaded files waiting for (or in) conversion
+RANK_CANDIDATES = True  # Compare several search results by metadata before downloading one
+CANDIDATE_COUNT = 5  # Search results fetched (metadata only) per track
+MAX_DURATION_DELTA = 30  # Seconds; results further from the Spotify duration get no duration score
+MIN_MATCH_SCORE = 0.6  # Below this the track is flagged as ambiguous instead of downloaded
+MIN_TITLE_SIMILARITY = 0.5  # Share of the artist/title words a result must contain, however well its length matches
+AMBIGUITY_MARGIN = 0.05
+
+# --- Rate Limiting ---
+OUTCOME_OK = "ok"
+OUTCOME_THROTTLED = "throttled"  # 429 / rate limited: back off for everyone
+OUTCOME_TRANSIENT = "transient"  # Network hiccup or 5xx: retry this request
+OUTCOME_FATAL = "fatal"  # Anything else: retrying will not help
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def parse_retry_after(headers):
+    """Returns the Retry-After header in seconds, or None if it is missing or not a number."""
+    try:
+        return max(0.0, float((headers or {}).get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+def classify_spotify_error(error):
+    """Returns (outcome, retry_after) for an exception raised by a spotipy call."""
+    status = getattr(error, 'http_status', None)
+    if status == 429:
+        return OUTCOME_THROTTLED, parse_retry_after(getattr(error, 'headers', None))
+    if status is not None:
+        return (OUTCOME_TRANSIENT if status >= 500 else OUTCOME_FATAL), None
+    # requests' exceptions derive from OSError (connection errors, timeouts).
+    return (OUTCOME_TRANSIENT if isinstance(error, OSError) else OUTCOME_FATAL), None
+
+def classify_youtube_error(error):
+    """Returns (outcome, retry_after) for an exception raised by a downloader backend."""
+    if not isinstance(error, DownloadError):
+        return OUTCOME_FATAL, None
+    message = str(error)
+    if re.search(r'HTTP Error 429|Too Many Requests', message, re.IGNORECASE):
+        return OUTCOME_THROTTLED, YOUTUBE_THROTTLE_PAUSE
+    if re.search(r'HTTP Error 5\d\d|timed out|Connection (reset|refused|aborted)|Temporary failure|IncompleteRead', message, re.IGNORECASE):
+        return OUTCOME_TRANSIENT, None
+    return OUTCOME_FATAL, None
+
+class AdaptiveLimiter:
+    """Shared rate and concurrency limit for all requests to one service.
+
+    Requests need a token from a token bucket and a free concurrency slot. Every healthy
+    response raises the rate and the concurrency limit additively; a throttled response
+    halves both and pauses every caller for the Retry-After time (AIMD, as in TCP).
+    """
+
+    def __init__(self, name, rate, max_rate, concurrency, max_concurrency):
+        self.name = name
+        self.rate = float(rate)
+        self.max_rate = float(max_rate)
+        self.concurrency = float(concurrency)
+        self.max_concurrency = float(max_concurrency)
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                elif self.in_flight >= int(self.concurrency):
+                    self.condition.wait()
+                elif self.tokens < 1:
+                    self.condition.wait((1 - self.tokens) / self.rate)
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+
+    def release(self, outcome, retry_after=None):
+        with self.condition:
+            self.in_flight -= 1
+            if outcome == OUTCOME_OK:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+            elif outcome == OUTCOME_THROTTLED:
+                self.throttled += 1
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.rate = max(MIN_REQUESTS_PER_SECOND, self.rate / 2)
+                pause = retry_after if retry_after is not None else backoff_delay(self.throttled)
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            self.condition.notify_all()
+
+    def call(self, function, *args, classify=classify_spotify_error, retries=RETRY_ATTEMPTS, **kwargs):
+        """Calls function under the limiter, retrying throttled and transient failures."""
+        for attempt in range(retries + 1):
+            self.acquire()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                outcome, retry_after = classify(e)
+                self.release(outcome, retry_after)
+                if outcome == OUTCOME_FATAL or attempt == retries:
+                    raise
+                if outcome == OUTCOME_TRANSIENT:
+                    time.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+                continue
+            self.release(OUTCOME_OK)
+            return result
+
+def create_spotify_limiter():
+    return AdaptiveLimiter("Spotify", SPOTIFY_REQUESTS_PER_SECOND, SPOTIFY_MAX_REQUESTS_PER_SECOND,
+                           PAGE_FETCH_WORKERS, PAGE_FETCH_WORKERS * 2)
+
+# --- Helper Functions ---
+def extract_playlist_id(url):
+    """Extracts the playlist ID from various Spotify URL formats."""
+    match = re.search(r'playlist/([a-zA-Z0-9]+)', url)
+    if match:
+        return match.group(1)
+    return None
+
+def extract_user_id(url):
+    """Extracts the user ID from a Spotify profile URL or URI (user/<id> or spotify:user:<id>)."""
+    match = re.search(r'user[/:]([A-Za-z0-9._-]+)', url)
+    if match and 'playlist' not in url:
+        return match.group(1)
+    return None
+
+def parse_playlist_sources(text):
+    """Splits whitespace or comma separated playlist/profile URLs into ([(playlist_id, priority)], [user_id], [invalid]).
+
+    A playlist URL may end in @N to give it priority N (default 1) in a batch.
+    """
+    playlists, user_ids, invalid = [], [], []
+    for source in re.split(r'[\s,]+', text.strip()):
+        if not source:
+            continue
+        url, priority = source, 1
+        match = re.match(r'(.+)@(\d+)$', source)
+        if match:
+            url, priority = match.group(1), int(match.group(2))
+        playlist_id = extract_playlist_id(url)
+        user_id = None if playlist_id else extract_user_id(url)
+        if playlist_id:
+            playlists.append((playlist_id, priority))
+        elif user_id:
+            user_ids.append(user_id)
+        else:
+            invalid.append(source)
+    return playlists, user_ids, invalid
+
+def sanitize_filename(name):
+    """Removes characters that are invalid for Windows filenames."""
+    sanitized = re.sub(r'[<>:"/\\|?*]', '', name)
+    sanitized = re.sub(r'\s+', ' ', sanitized).strip()
+    return sanitized
+
+def track_filename_base(artist, name):
+    """Returns the file name (without extension) a track is saved under."""
+    return sanitize_filename(f"{artist} - {name}")
+
+def track_key(track):
+    """Identifies a song across playlists: its Spotify ID, or its file name for local tracks without one."""
+    return track['id'] or track_filename_base(track['artist'], track['name'])
+
+def track_output_base(track):
+    """Returns the file name (without extension) claimed for a track in its playlist folder, see DirectoryIndex.claim."""
+    return track.get('filename') or track_filename_base(track['artist'], track['name'])
+
+def output_extensions(output_format):
+    """Returns the file extensions that count as an existing download for an output format."""
+    return ("mp3",) if output_format == OUTPUT_MP3 else AUDIO_EXTENSIONS
+
+def find_audio_file(directory, filename_base, extensions):
+    """Returns the path of filename_base saved with any of the given extensions, or None."""
+    for ext in extensions:
+        path = os.path.join(directory, f"{filename_base}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+def link_file(source, destination):
+    """Places source at destination. Returns the method used: 'hardlink', 'symlink' or 'copy'."""
+    try:
+        os.link(source, destination)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(source), destination)
+        return "symlink"
+    except OSError:
+        pass
+    shutil.copy2(source, destination)
+    return "copy"
+
+def parse_track_item(item):
+    """Converts a playlist item from the Spotify API into a track dict, or None if it is unusable."""
+    track = item.get('track') if item else None
+    if track and track.get('name') and track.get('artists'):
+        return {
+            'id': track.get('id'),
+            'isrc': (track.get('external_ids') or {}).get('isrc'),
+            'artist': track['artists'][0]['name'],
+            'name': track['name'],
+            'duration_ms': track.get('duration_ms'),
+        }
+    return None
+
+def fetch_playlist_page(client, playlist_id, offset, fields=PLAYLIST_ITEM_FIELDS, limiter=None, metrics=None):
+    """Fetches one page of playlist items at the given offset, retrying throttled and transient failures."""
+    limiter = limiter or create_spotify_limiter()
+    started = time.perf_counter()
+    page = limiter.call(client.playlist_items, playlist_id, fields=fields, limit=PAGE_SIZE, offset=offset)
+    if metrics:
+        metrics.record(STAGE_FETCH_PAGE, time.perf_counter() - started)
+    return page
+
+def iter_playlist_pages_parallel(client, playlist_id, max_workers=PAGE_FETCH_WORKERS, first_page=None, limiter=None, metrics=None):
+    """Yields playlist pages in playlist order while fetching up to max_workers pages concurrently.
+
+    All offsets are computed up front from the 'total' of the first page. At most
+    2 * max_workers pages are held in memory at once.
+    """
+    limiter = limiter or create_spotify_limiter()
+    if first_page is None:
+        first_page = fetch_playlist_page(client, playlist_id, 0, limiter=limiter, metrics=metrics)
+    yield first_page
+
+    offsets = iter(range(len(first_page['items']) or PAGE_SIZE, first_page.get('total') or 0, PAGE_SIZE))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = collections.deque()
+        try:
+            for offset in itertools.islice(offsets, max_workers * 2):
+                pending.append(executor.submit(fetch_playlist_page, client, playlist_id, offset, limiter=limiter, metrics=metrics))
+            while pending:
+                page = pending.popleft().result()
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending.append(executor.submit(fetch_playlist_page, client, playlist_id, offset, limiter=limiter, metrics=metrics))
+                yield page
+        finally:
+            for future in pending:
+                future.cancel()
+
+def is_valid_credential(value):
+    """Checks if a credential value is present and not a placeholder."""
+    return value not in PLACEHOLDER_VALUES
+
+def hidden_startupinfo():
+    """Returns STARTUPINFO that hides the console window of child processes on Windows, else None."""
+    if os.name != 'nt':
+        return None
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    startupinfo.wShowWindow = subprocess.SW_HIDE
+    return startupinfo
+
+def when_done(result, callback):
+    """Applies callback to result, or to its value once ready if result is a Future from the transcode stage."""
+    if not isinstance(result, concurrent.futures.Future):
+        return callback(result)
+    chained = concurrent.futures.Future()
+
+    def on_done(future):
+        try:
+            chained.set_result(callback(future.result()))
+        except Exception as e:
+            chained.set_exception(e)
+
+    result.add_done_callback(on_done)
+    return chained
+
+def token_cache_path(client_id, path=TOKEN_CACHE_FILE):
+    """Returns the token cache file for a client ID, so changing the credentials never reuses an old token."""
+    return f"{path}-{hashlib.sha1(client_id.encode('utf-8')).hexdigest()[:12]}"
+
+def create_spotify_client(client_id, client_secret, cache_token=True):
+    """Creates a Spotify client using the client credentials flow.
+
+    With cache_token the access token is stored on disk and reused until it expires, so a new
+    process doesn't have to request one. spotipy (and requests) is only imported here, as it is
+    the slowest import and nothing needs it before the first API call.
+
+    The client gets a plain requests session instead of spotipy's default one, which retries 429
+    and 5xx responses itself (waiting out Retry-After inside a limiter slot) and then reports them
+    all as a 429 without headers. This way every response reaches the Spotify AdaptiveLimiter
+    with its real status and Retry-After header.
+    """
+    import requests
+    import spotipy
+    from spotipy.cache_handler import CacheFileHandler
+    from spotipy.oauth2 import SpotifyClientCredentials
+    cache_handler = CacheFileHandler(cache_path=token_cache_path(client_id)) if cache_token else None
+    client_credentials_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret, cache_handler=cache_handler)
+    return spotipy.Spotify(client_credentials_manager=client_credentials_manager, requests_session=requests.Session())
+
+# --- Candidate Ranking ---
+DURATION_WEIGHT = 0.6  # Share of the score from the duration match; the rest comes from title similarity
+NOISE_PENALTY = 0.25  # Subtracted per version marker (live, loop, cover, ...) the Spotify title doesn't have
+NOISE_WORDS = {"live", "loop", "hour", "hours", "extended", "cover", "remix", "karaoke", "slowed", "reverb",
+               "sped", "nightcore", "8d", "reaction", "mashup", "tutorial"}
+
+class AmbiguousMatchError(Exception):
+    """Raised when no search result matches a track well enough to download it."""
+
+def title_words(text):
+    return set(re.findall(r"\w+", (text or "").lower()))
+
+def score_candidate(track, candidate):
+    """Scores a metadata-only search result from 0 to 1 by duration delta and title similarity.
+
+    A result sharing fewer than MIN_TITLE_SIMILARITY of the artist/title words scores 0, as a matching
+    length alone would otherwise be enough to clear MIN_MATCH_SCORE.
+    """
+    wanted = title_words(f"{track['artist']} {track['name']}")
+    found = title_words(f"{candidate.get('uploader') or ''} {candidate.get('title') or ''}")
+    similarity = len(wanted & found) / len(wanted) if wanted else 0.0
+    if similarity < MIN_TITLE_SIMILARITY:
+        return 0.0
+    duration_ms = track.get('duration_ms')
+    if duration_ms and candidate.get('duration'):
+        delta = abs(candidate['duration'] - duration_ms / 1000)
+        duration_score = max(0.0, 1 - delta / MAX_DURATION_DELTA)
+        score = DURATION_WEIGHT * duration_score + (1 - DURATION_WEIGHT) * similarity
+    else:
+        score = similarity
+    noise = (title_words(candidate.get('title')) & NOISE_WORDS) - title_words(track['name'])
+    return max(0.0, score - NOISE_PENALTY * len(noise))
+
+def choose_candidate(track, candidates):
+    """Returns the best-scoring candidate, or raises AmbiguousMatchError if none is a confident match."""
+    if not candidates:
+        raise AmbiguousMatchError("no search results")
+    ranked = sorted(((score_candidate(track, candidate), candidate) for candidate in candidates),
+                    key=lambda ranked_candidate: ranked_candidate[0], reverse=True)
+    best_score, best = ranked[0]
+    if best_score < MIN_MATCH_SCORE:
+        raise AmbiguousMatchError(f"best result '{best.get('title')}' only scored {best_score:.2f}")
+    if len(ranked) > 1:
+        runner_up_score, runner_up = ranked[1]
+        if (best_score - runner_up_score < AMBIGUITY_MARGIN and best.get('duration') and runner_up.get('duration')
+                and abs(best['duration'] - runner_up['duration']) > MAX_DURATION_DELTA):
+            raise AmbiguousMatchError(f"'{best.get('title')}' and '{runner_up.get('title')}' match equally well "
+                                      f"but have different lengths")
+    return dict(best, score=best_score)
+
+# --- Downloader Backends ---
+class DownloadError(Exception):
+    """Raised by a downloader backend when yt-dlp fails for a single track."""
+
+def search_result(entry):
+    """Converts a flat yt-dlp search entry into the dict returned by BaseDownloader.search."""
+    return {
+        'video_id': entry['id'],
+        'title': entry.get('title'),
+        'uploader': entry.get('channel') or entry.get('uploader'),
+        'duration': entry.get('duration'),
+    }
+
+class BaseDownloader:
+    """Common interface for the yt-dlp backends used by download_track."""
+    name = "base"
+    supports_search = False  # Backends that implement search() set this; the others download the first result
+
+    def download(self, source, output_path_template, audio_format="mp3"):
+        """Downloads source (a 'ytsearch1:' query or a video URL).
+
+        audio_format is passed to yt-dlp's audio extraction: "mp3" converts, "best" only remuxes
+        the audio stream into its own container, and None saves the best audio stream as-is.
+        Returns a dict with 'confirmed' (yt-dlp reported an output file), 'filepath', 'video_id'
+        and 'title' of the downloaded video when known, 'download_seconds', the part of the call
+        spent transferring audio (None if the backend can't tell), and 'details', a list of
+        (label, text) pairs worth logging when the download was not confirmed.
+        Raises DownloadError if yt-dlp fails and FileNotFoundError if yt-dlp is not available.
+        """
+        raise NotImplementedError
+
+    def search(self, query, count):
+        """Returns metadata for the first count YouTube search results without downloading anything.
+
+        Each result is a dict with 'video_id', 'title', 'uploader' and 'duration' (seconds, or None).
+        Only called when supports_search is set. Raises DownloadError if the search fails.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class SubprocessDownloader(BaseDownloader):
+    """Runs a separate yt-dlp.exe process for every track."""
+    name = BACKEND_SUBPROCESS
+    supports_search = True
+
+    def download(self, source, output_path_template, audio_format="mp3"):
+        command = [YT_DLP_EXECUTABLE, source]
+        if audio_format:
+            command += ["-x", "--audio-format", audio_format, "--audio-quality", "0"]
+        else:
+            command += ["-f", "bestaudio/best"]
+        command += [
+            "-o", output_path_template,
+            "--no-playlist",
+            "--print", "after_move:RESOLVED %(id)s|%(filepath)s|%(title)s",
+            "--encoding", "utf-8"
+        ]
+
+        try:
+            result = subprocess.run(command, check=True, capture_output=True, text=True, encoding='utf-8', errors='ignore', startupinfo=hidden_startupinfo())
+        except subprocess.CalledProcessError as e:
+            raise DownloadError(e.stderr if e.stderr else "No stderr output.")
+        resolved = re.search(r'^RESOLVED ([^|]*)\|([^|]*)\|(.*)$', result.stdout, re.MULTILINE)
+        return {
+            'confirmed': bool(resolved) or "has already been downloaded" in result.stdout or "Destination:" in result.stdout,
+            'filepath': resolved.group(2) if resolved else None,
+            'video_id': resolved.group(1) if resolved else None,
+            'title': resolved.group(3) if resolved else None,
+            'details': [("yt-dlp stdout", result.stdout), ("yt-dlp stderr", result.stderr)],
+            'download_seconds': None,
+        }
+
+    def search(self, query, count):
+        command = [YT_DLP_EXECUTABLE, f"ytsearch{count}:{query}", "--flat-playlist", "--dump-json", "--no-warnings", "--encoding", "utf-8"]
+        try:
+            result = subprocess.run(command, check=True, capture_output=True, text=True, encoding='utf-8', errors='ignore', startupinfo=hidden_startupinfo())
+        except subprocess.CalledProcessError as e:
+            raise DownloadError(e.stderr if e.stderr else "No stderr output.")
+        entries = []
+        for line in result.stdout.splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return [search_result(entry) for entry in entries if entry.get('id')]
+
+class YoutubeDLDownloader(BaseDownloader):
+    """Drives yt-dlp's YoutubeDL API in-process.
+
+    Each worker thread keeps one warmed YoutubeDL instance per output mode, so extractors and
+    the HTTP connection pool are reused across tracks instead of being rebuilt per process.
+    """
+    name = BACKEND_IN_PROCESS
+    supports_search = True
+
+    def __init__(self):
+        try:
+            import yt_dlp
+        except ImportError:
+            raise FileNotFoundError("The yt-dlp Python package is not installed (pip install yt-dlp).")
+        self.yt_dlp = yt_dlp
+        self.local = threading.local()
+        self.instances = []
+        self.instances_lock = threading.Lock()
+
+    def get_instance(self, audio_format):
+        if not hasattr(self.local, 'instances'):
+            self.local.instances = {}
+            self.local.files = []
+        ydl = self.local.instances.get(audio_format)
+        if ydl is None:
+            options = {
+                'format': 'bestaudio/best',
+                'noplaylist': True,
+                'quiet': True,
+                'no_warnings': True,
+                'noprogress': True,
+                'encoding': 'utf-8',
+                'post_hooks': [self.local.files.append],
+                'progress_hooks': [self.on_progress],
+            }
+            if audio_format:
+                options['postprocessors'] = [{'key': 'FFmpegExtractAudio', 'preferredcodec': audio_format, 'preferredquality': '0'}]
+            if os.path.exists(FFMPEG_EXECUTABLE):
+                options['ffmpeg_location'] = os.path.abspath(FFMPEG_EXECUTABLE)
+            ydl = self.yt_dlp.YoutubeDL(options)
+            self.local.instances[audio_format] = ydl
+            with self.instances_lock:
+                self.instances.append(ydl)
+        return ydl
+
+    def search(self, query, count):
+        if not hasattr(self.local, 'searcher'):
+            # extract_flat lists the results from the search page itself, without resolving every video.
+            self.local.searcher = self.yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'extract_flat': 'in_playlist',
+                                                         'skip_download': True, 'encoding': 'utf-8'})
+            with self.instances_lock:
+                self.instances.append(self.local.searcher)
+        try:
+            info = self.local.searcher.extract_info(f"ytsearch{count}:{query}", download=False)
+        except self.yt_dlp.utils.DownloadError as e:
+            raise DownloadError(str(e))
+        return [search_result(entry) for entry in (info or {}).get('entries') or [] if entry and entry.get('id')]
+
+    def on_progress(self, status):
+        if status.get('status') == 'finished' and status.get('elapsed') is not None:
+            self.local.download_seconds += status['elapsed']
+
+    def download(self, source, output_path_template, audio_format="mp3"):
+        ydl = self.get_instance(audio_format)
+        self.local.files.clear()
+        self.local.download_seconds = 0.0
+        ydl.params['outtmpl']['default'] = output_path_template
+        try:
+            info = ydl.extract_info(source, download=True)
+        except self.yt_dlp.utils.DownloadError as e:
+            raise DownloadError(str(e))
+        if info and 'entries' in info:
+            info = next((entry for entry in info['entries'] if entry), None)
+        return {
+            'confirmed': bool(self.local.files),
+            'filepath': self.local.files[-1] if self.local.files else None,
+            'video_id': info.get('id') if info else None,
+            'title': info.get('title') if info else None,
+            'details': [],
+            'download_seconds': self.local.download_seconds or None,
+        }
+
+    def close(self):
+        with self.instances_lock:
+            for ydl in self.instances:
+                ydl.close()
+            self.instances.clear()
+
+def create_downloader(backend=DEFAULT_BACKEND):
+    """Returns a downloader for the given backend name. 'auto' prefers the in-process engine when yt-dlp is importable."""
+    if backend == BACKEND_AUTO:
+        try:
+            return YoutubeDLDownloader()
+        except FileNotFoundError:
+            return SubprocessDownloader()
+    if backend == BACKEND_IN_PROCESS:
+        return YoutubeDLDownloader()
+    if backend == BACKEND_SUBPROCESS:
+        return SubprocessDownloader()
+    raise ValueError(f"Unknown downloader backend: {backend}")
+
+# --- Transcode Stage ---
+class TranscodeStage:
+    """Converts downloaded audio to MP3 with ffmpeg, separately from the network downloads.
+
+    Runs one ffmpeg process per worker (CPU count by default). submit() blocks while
+    buffer_size conversions are already queued or running, which slows the download
+    workers down instead of letting downloaded files pile up. If ffmpeg is missing the
+    downloaded files are kept, cancel_event is set and finish() raises RuntimeError.
+    """
+
+    def __init__(self, msg_queue, workers=None, buffer_size=TRANSCODE_BUFFER_SIZE, metrics=None, cancel_event=None):
+        self.msg_queue = msg_queue
+        self.metrics = metrics
+        self.cancel_event = cancel_event
+        self.error = None
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcode")
+        self.slots = threading.BoundedSemaphore(max(buffer_size, self.workers))
+        self.ffmpeg = FFMPEG_EXECUTABLE if os.path.exists(FFMPEG_EXECUTABLE) else "ffmpeg"
+
+    def submit(self, source, destination, label, track=None):
+        """Queues a conversion. Returns a Future that resolves to True once destination is written."""
+        self.slots.acquire()
+        future = self.executor.submit(self.transcode, source, destination, label, track)
+        future.add_done_callback(lambda f: self.slots.release())
+        return future
+
+    def transcode(self, source, destination, label, track=None):
+        temp_destination = destination + ".part"
+        command = [
+            self.ffmpeg, "-y", "-nostdin", "-v", "error",
+            "-i", source,
+            "-vn", "-codec:a", "libmp3lame", "-q:a", "0",
+            "-f", "mp3", temp_destination,
+        ]
+        if self.error:
+            return None  # Stopped; the source stays for the next run to convert (see DownloadEngine.resume_job)
+        started = time.perf_counter()
+        try:
+            subprocess.run(command, check=True, capture_output=True, text=True, encoding='utf-8', errors='ignore', startupinfo=hidden_startupinfo())
+            os.replace(temp_destination, destination)
+        except FileNotFoundError:
+            if self.error is None:
+                self.error = RuntimeError("ffmpeg not found")
+                self.msg_queue.put(("log", f"Error: '{self.ffmpeg}' not found. Make sure it's in your PATH or the script's directory."))
+            if self.cancel_event:
+                self.cancel_event.set()
+            return None
+        except subprocess.CalledProcessError as e:
+            self.msg_queue.put(("log", f"Error converting '{label}'. ffmpeg failed:\n{(e.stderr or 'No stderr output.')[:500]}"))
+            return False
+        finally:
+            try:
+                os.remove(temp_destination)
+            except OSError:
+                pass
+        # Only a finished conversion may delete the download; the journal points at it until then.
+        try:
+            os.remove(source)
+        except OSError:
+            pass
+        if self.metrics:
+            self.metrics.record(STAGE_TRANSCODE, time.perf_counter() - started, os.path.getsize(destination), track=track)
+        self.msg_queue.put(("log", f"Converted: '{os.path.basename(destination)}'"))
+        return True
+
+    def close(self):
+        """Waits for every queued conversion to finish."""
+        self.executor.shutdown(wait=True)
+
+    def finish(self):
+        """Waits for every queued conversion, then raises the error that stopped the stage, if any."""
+        self.close()
+        if self.error:
+            raise self.error
+
+# --- Resolution Cache ---
+class ResolutionCache:
+    """Persistent SQLite cache mapping Spotify tracks to the YouTube video chosen for them.
+
+    Entries are keyed by Spotify track ID plus search suffix and can also be found by ISRC,
+    so the same recording in another playlist or release reuses the earlier match. Entries
+    older than ttl seconds are ignored, and the least recently used entries are evicted once
+    the cache holds more than max_entries.
+    """
+
+    def __init__(self, path=RESOLUTION_CACHE_FILE, ttl=RESOLUTION_CACHE_TTL, max_entries=RESOLUTION_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS resolutions ("
+                " track_id TEXT NOT NULL,"
+                " search_suffix TEXT NOT NULL,"
+                " isrc TEXT,"
+                " video_id TEXT NOT NULL,"
+                " title TEXT,"
+                " resolved_at REAL NOT NULL,"
+                " last_used REAL NOT NULL,"
+                " PRIMARY KEY (track_id, search_suffix))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS resolutions_isrc ON resolutions (isrc, search_suffix)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS resolutions_last_used ON resolutions (last_used)")
+        self.evict()
+
+    def get(self, track, search_suffix):
+        """Returns the cached {'video_id', 'title'} for a track, or None on a miss."""
+        track_id, isrc = track.get('id'), track.get('isrc')
+        if not track_id and not isrc:
+            return None
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT track_id, video_id, title FROM resolutions"
+                " WHERE search_suffix = ? AND resolved_at >= ? AND (track_id = ? OR (isrc IS NOT NULL AND isrc = ?))"
+                " ORDER BY track_id = ? DESC, last_used DESC LIMIT 1",
+                (search_suffix, now - self.ttl, track_id, isrc, track_id),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.conn:
+                self.conn.execute("UPDATE resolutions SET last_used = ? WHERE track_id = ? AND search_suffix = ?", (now, row[0], search_suffix))
+        return {'video_id': row[1], 'title': row[2]}
+
+    def put(self, track, search_suffix, video_id, title=None):
+        if not track.get('id') or not video_id:
+            return
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO resolutions (track_id, search_suffix, isrc, video_id, title, resolved_at, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (track['id'], search_suffix, track.get('isrc'), video_id, title, now, now),
+                )
+            self.stores += 1
+        if self.stores % RESOLUTION_CACHE_EVICT_INTERVAL == 0:
+            self.evict()
+
+    def invalidate(self, track, search_suffix):
+        """Drops the cached match for a track, e.g. after the video became unavailable."""
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM resolutions WHERE search_suffix = ? AND (track_id = ? OR (isrc IS NOT NULL AND isrc = ?))",
+                    (search_suffix, track.get('id'), track.get('isrc')),
+                )
+
+    def evict(self):
+        """Removes expired entries, then the least recently used ones beyond max_entries."""
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM resolutions WHERE resolved_at < ?", (time.time() - self.ttl,))
+                self.conn.execute(
+                    "DELETE FROM resolutions WHERE rowid IN"
+                    " (SELECT rowid FROM resolutions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# --- Playlist Manifest ---
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class PlaylistManifest:
+    """Record of the tracks a sync run placed in a playlist folder.
+
+    Stored as JSON in the folder itself and maps Spotify track ID to file name, size and
+    SHA-256, together with the playlist snapshot_id the folder was last fully synced to.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILENAME)
+        self.lock = threading.Lock()
+        self.data = {'playlist_id': None, 'snapshot_id': None, 'search_suffix': None, 'output_format': None, 'tracks': {}}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.data.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest '{self.path}': {e}", file=sys.stderr)
+
+    def is_unchanged(self, playlist_id, snapshot_id, search_suffix, output_format):
+        """True if the folder was fully synced to this exact playlist snapshot with the same settings."""
+        return (snapshot_id is not None
+                and self.data['playlist_id'] == playlist_id
+                and self.data['snapshot_id'] == snapshot_id
+                and self.data['search_suffix'] == search_suffix
+                and self.data['output_format'] == output_format)
+
+    def has_file(self, track_id, index=None):
+        """True if the manifest lists the track and its file is still present with the recorded size."""
+        with self.lock:
+            entry = self.data['tracks'].get(track_id)
+        if not entry:
+            return False
+        if index:
+            found = index.get(entry['file'])
+            return found is not None and found[1] == entry['size']
+        try:
+            return os.path.getsize(os.path.join(self.directory, entry['file'])) == entry['size']
+        except OSError:
+            return False
+
+    def file(self, track_id):
+        """Returns the file name recorded for a track, or None."""
+        with self.lock:
+            entry = self.data['tracks'].get(track_id)
+        return entry['file'] if entry else None
+
+    def files(self):
+        """Returns {track_id: file name} for every recorded track."""
+        with self.lock:
+            return {track_id: entry['file'] for track_id, entry in self.data['tracks'].items()}
+
+    def record(self, track_id, path):
+        entry = {'file': os.path.basename(path), 'size': os.path.getsize(path), 'sha256': file_sha256(path)}
+        with self.lock:
+            self.data['tracks'][track_id] = entry
+
+    def removed_tracks(self, seen_ids):
+        """Returns {track_id: entry} for manifest tracks that are no longer in the playlist."""
+        with self.lock:
+            return {track_id: entry for track_id, entry in self.data['tracks'].items() if track_id not in seen_ids}
+
+    def remove(self, track_id, delete_file=False):
+        with self.lock:
+            entry = self.data['tracks'].pop(track_id, None)
+        if entry and delete_file:
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except FileNotFoundError:
+                pass
+        return entry
+
+    def save(self, playlist_id, snapshot_id, search_suffix, output_format):
+        """Atomically writes the manifest. Pass snapshot_id=None when the run did not complete."""
+        with self.lock:
+            self.data.update(playlist_id=playlist_id, snapshot_id=snapshot_id, search_suffix=search_suffix, output_format=output_format)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=1)
+            os.replace(temp_path, self.path)
+
+# --- Directory Index ---
+def normalize_filename(name):
+    """Returns the form two file names are compared in: Unicode NFC, case-folded, whitespace collapsed."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', name)).strip().casefold()
+
+class DirectoryIndex:
+    """In-memory index of the audio files in one folder: normalized name -> extension -> (path, size, mtime).
+
+    The folder is listed once with os.scandir, so checking whether a track already exists is a dict
+    lookup instead of a stat per track (slow on network shares). Lookups ignore case and accept any
+    of the given extensions. The engine keeps the index current as files are written or removed.
+    If the folder can't be listed, lookups fall back to checking the file system.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.owners = {}  # Normalized name -> track that claimed it
+        self.complete = False
+        self.scan()
+
+    def scan(self):
+        entries = {}
+        try:
+            with os.scandir(self.directory) as scanned:
+                for entry in scanned:
+                    base, ext = os.path.splitext(entry.name)
+                    if ext[1:].lower() in AUDIO_EXTENSIONS and entry.is_file():
+                        stat = entry.stat()
+                        entries.setdefault(normalize_filename(base), {})[ext[1:].lower()] = (entry.path, stat.st_size, stat.st_mtime)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return
+        with self.lock:
+            self.entries = entries
+            self.complete = True
+
+    def find(self, filename_base, extensions):
+        """Returns the path of filename_base saved with any of the given extensions (in their order), or None."""
+        if not self.complete:
+            return find_audio_file(self.directory, filename_base, extensions)
+        with self.lock:
+            files = self.entries.get(normalize_filename(filename_base), {})
+            for ext in extensions:
+                if ext in files:
+                    return files[ext][0]
+        return None
+
+    def get(self, filename):
+        """Returns (path, size, mtime) for a file name with extension, or None if it is not in the folder."""
+        if not self.complete:
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            return path, stat.st_size, stat.st_mtime
+        base, ext = os.path.splitext(filename)
+        with self.lock:
+            return self.entries.get(normalize_filename(base), {}).get(ext[1:].lower())
+
+    def add(self, path):
+        """Records a file that was just written. Returns False if it no longer exists."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.discard(path)
+            return False
+        base, ext = os.path.splitext(os.path.basename(path))
+        with self.lock:
+            self.entries.setdefault(normalize_filename(base), {})[ext[1:].lower()] = (path, stat.st_size, stat.st_mtime)
+        return True
+
+    def discard(self, path):
+        base, ext = os.path.splitext(os.path.basename(path))
+        with self.lock:
+            files = self.entries.get(normalize_filename(base))
+            if files:
+                files.pop(ext[1:].lower(), None)
+
+    def refresh(self, filename_base, extensions):
+        """Re-reads the files of one name from disk, after a download or conversion that may have written any of them."""
+        for ext in extensions:
+            self.add(os.path.join(self.directory, f"{filename_base}.{ext}"))
+
+    def claim(self, filename_base, owner):
+        """Returns the file name owner should use: filename_base, or 'filename_base (N)' if another track got there first.
+
+        Tracks are claimed in playlist order, so the same playlist always resolves a collision the same way.
+        """
+        with self.lock:
+            candidate, number = filename_base, 1
+            while self.owners.setdefault(normalize_filename(candidate), owner) != owner:
+                number += 1
+                candidate = f"{filename_base} ({number})"
+            return candidate
+
+# --- Content Store ---
+class ContentStore:
+    """Content-addressed store that holds every downloaded track once, keyed by Spotify track ID.
+
+    Playlist folders get hardlinks to the stored files, falling back to symlinks and then to
+    plain copies when the file system does not support links.
+    """
+
+    def __init__(self, directory=CONTENT_STORE_DIR, output_format=DEFAULT_OUTPUT_FORMAT):
+        self.directory = directory
+        self.output_format = output_format
+        os.makedirs(directory, exist_ok=True)
+        self.locks = collections.defaultdict(threading.Lock)
+        self.locks_lock = threading.Lock()
+        self.index = DirectoryIndex(directory)
+        self.reused = 0
+        self.stored = 0
+
+    def key(self, track_id, search_suffix):
+        """Lyrics and instrumental searches give different audio, so the suffix is part of the key.
+
+        Native and remux runs add their format as well, so they never link the lossy file of an MP3 run.
+        """
+        key = f"{track_id}.{re.sub(r'[^A-Za-z0-9]+', '_', search_suffix).strip('_') or 'plain'}"
+        return key if self.output_format == OUTPUT_MP3 else f"{key}.{self.output_format}"
+
+    def accepts(self, path):
+        """Returns False for an MP3 offered to a native or remux store, which must only hold the original audio."""
+        return self.output_format == OUTPUT_MP3 or not path.lower().endswith(".mp3")
+
+    def find(self, track_id, search_suffix, extensions):
+        """Returns the stored file for a track in one of the given formats, or None."""
+        return self.index.find(self.key(track_id, search_suffix), extensions)
+
+    def lock_for(self, track_id, search_suffix):
+        """Returns the lock that serializes work on one stored file across worker threads."""
+        with self.locks_lock:
+            return self.locks[self.key(track_id, search_suffix)]
+
+    def link(self, source, destination):
+        return link_file(source, destination)
+
+    def stats(self):
+        return {'reused': self.reused, 'stored': self.stored}
+
+# --- Job Journal ---
+JOB_PENDING = "pending"  # Fetched from the playlist, not started yet
+JOB_DOWNLOADING = "downloading"  # yt-dlp is running; files for this track may be incomplete
+JOB_RESOLVED = "resolved"  # Audio downloaded, waiting for conversion or placement
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+class JobJournal:
+    """Append-only log of per-track job state in a playlist folder, used to resume interrupted runs.
+
+    Every state change is appended as one JSON line, so a crash loses at most the line being
+    written. Opening the journal replays it, drops a torn last line and compacts it to one line
+    per track. A journal written with other settings is discarded.
+    """
+
+    def __init__(self, directory, playlist_id, search_suffix, output_format):
+        self.path = os.path.join(directory, JOURNAL_FILENAME)
+        self.lock = threading.Lock()
+        self.header = {'playlist_id': playlist_id, 'search_suffix': search_suffix, 'output_format': output_format}
+        self.jobs = {}
+        self.load()
+        self.compact()
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def key(track):
+        return track_key(track)
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"Ignoring unreadable journal '{self.path}': {e}", file=sys.stderr)
+            return
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break  # Torn write from a crash; everything after it is unreliable.
+        if not records or records[0].get('header') != self.header:
+            return
+        for record in records[1:]:
+            self.jobs.setdefault(record.pop('key'), {}).update(record)
+
+    def compact(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'header': self.header}) + "\n")
+            for key, job in self.jobs.items():
+                f.write(json.dumps(dict(job, key=key)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def get(self, track):
+        with self.lock:
+            return dict(self.jobs.get(self.key(track)) or {})
+
+    def record(self, track, state, sync=True, **fields):
+        """Appends a state change. sync=False skips the fsync for records that are cheap to lose."""
+        key = self.key(track)
+        with self.lock:
+            job = self.jobs.setdefault(key, {'id': track['id'], 'isrc': track.get('isrc'), 'artist': track['artist'],
+                                             'name': track['name'], 'duration_ms': track.get('duration_ms'), 'attempts': 0})
+            if state == JOB_DOWNLOADING:
+                job['attempts'] += 1
+            if track.get('filename'):
+                job['filename'] = track['filename']
+            job['state'] = state
+            job.update(fields)
+            self.file.write(json.dumps(dict(job, key=key)) + "\n")
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+
+    def files(self):
+        """Returns {key: file name (without extension)} for every job that has claimed a file name."""
+        with self.lock:
+            return {key: job['filename'] for key, job in self.jobs.items() if job.get('filename')}
+
+    def counts(self):
+        with self.lock:
+            return collections.Counter(job['state'] for job in self.jobs.values())
+
+    def failed_tracks(self):
+        """Returns track dicts for every job whose last attempt failed."""
+        with self.lock:
+            return [{field: job.get(field) for field in ('id', 'isrc', 'artist', 'name', 'duration_ms')}
+                    for job in self.jobs.values() if job['state'] == JOB_FAILED]
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+# --- Metrics ---
+STAGE_FETCH_PAGE = "fetch_page"  # One Spotify API page (including rate-limit waits and retries)
+STAGE_RESOLVE = "resolve"  # YouTube search for candidates, and video extraction with the in-process engine
+STAGE_DOWNLOAD = "download"  # Audio download; with the yt-dlp.exe engine this includes the video extraction
+STAGE_TRANSCODE = "transcode"
+STAGE_FILESYSTEM = "filesystem"  # Linking from the store and hashing for the sync manifest
+STAGES = (STAGE_FETCH_PAGE, STAGE_RESOLVE, STAGE_DOWNLOAD, STAGE_TRANSCODE, STAGE_FILESYSTEM)
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+class RunMetrics:
+    """Per-stage timings of one playlist run.
+
+    Every timed event is appended to a JSON lines file, which is rotated once it reaches
+    METRICS_JSONL_MAX_BYTES; totals per stage are exported in the Prometheus text format
+    (for node_exporter's textfile collector) while the run progresses.
+    """
+
+    def __init__(self, playlist_id, jsonl_path=METRICS_JSONL_FILE, prometheus_path=METRICS_PROM_FILE):
+        self.playlist_id = playlist_id
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.last_export = self.started
+        self.stages = {stage: {'count': 0, 'seconds': 0.0, 'bytes': 0} for stage in STAGES}
+        self.events_file = None
+        if jsonl_path:
+            self.open_events_file()
+
+    def open_events_file(self):
+        if os.path.exists(self.jsonl_path) and os.path.getsize(self.jsonl_path) >= METRICS_JSONL_MAX_BYTES:
+            for number in range(METRICS_JSONL_BACKUPS - 1, 0, -1):
+                if os.path.exists(f"{self.jsonl_path}.{number}"):
+                    os.replace(f"{self.jsonl_path}.{number}", f"{self.jsonl_path}.{number + 1}")
+            os.replace(self.jsonl_path, f"{self.jsonl_path}.1")
+        self.events_file = open(self.jsonl_path, 'a', encoding='utf-8')
+        self.events_bytes = self.events_file.tell()
+
+    def record(self, stage, seconds, nbytes=0, track=None):
+        event = {'time': round(time.time(), 3), 'playlist': self.playlist_id, 'stage': stage, 'seconds': round(seconds, 4)}
+        if nbytes:
+            event['bytes'] = nbytes
+        if track:
+            event['track'] = f"{track['artist']} - {track['name']}"
+        with self.lock:
+            totals = self.stages[stage]
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['bytes'] += nbytes
+            if self.events_file:
+                line = json.dumps(event) + "\n"
+                self.events_file.write(line)
+                self.events_bytes += len(line)  # json.dumps escapes non-ASCII, so characters are bytes
+                if self.events_bytes >= METRICS_JSONL_MAX_BYTES:
+                    self.events_file.close()
+                    try:
+                        self.open_events_file()
+                    except OSError as e:
+                        self.events_file = None
+                        print(f"Could not rotate metrics file '{self.jsonl_path}': {e}", file=sys.stderr)
+
+    def throughput(self, completed, total):
+        """Returns (tracks per minute, downloaded MB per second, ETA in seconds or None)."""
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        with self.lock:
+            downloaded_bytes = self.stages[STAGE_DOWNLOAD]['bytes']
+        tracks_per_minute = completed * 60 / elapsed
+        eta = (total - completed) * 60 / tracks_per_minute if tracks_per_minute and total else None
+        return tracks_per_minute, downloaded_bytes / elapsed / 1e6, eta
+
+    def status_suffix(self, completed, total):
+        tracks_per_minute, mb_per_second, eta = self.throughput(completed, total)
+        text = f"{tracks_per_minute:.1f} tracks/min, {mb_per_second:.2f} MB/s"
+        return text + (f", ETA {format_duration(eta)}" if eta is not None else "")
+
+    def summary(self):
+        """Returns one line with the time spent per stage, e.g. for the end-of-run log."""
+        with self.lock:
+            parts = []
+            for stage, totals in self.stages.items():
+                if not totals['count']:
+                    continue
+                part = f"{stage} {totals['seconds']:.1f}s"
+                if totals['bytes'] and totals['seconds']:
+                    part += f" ({totals['bytes'] / totals['seconds'] / 1e6:.2f} MB/s)"
+                parts.append(part)
+        return ", ".join(parts)
+
+    def maybe_export(self, progress):
+        now = time.monotonic()
+        if now - self.last_export >= METRICS_EXPORT_INTERVAL:
+            self.last_export = now
+            self.export_prometheus(progress)
+
+    def export_prometheus(self, progress):
+        if not self.prometheus_path:
+            return
+        label = self.playlist_id.replace('\\', '\\\\').replace('"', '\\"')
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f"# HELP spotify_downloader_{name} {help_text}")
+            lines.append(f"# TYPE spotify_downloader_{name} {metric_type}")
+            for labels, value in samples:
+                labels = ",".join([f'playlist="{label}"'] + [f'{key}="{val}"' for key, val in labels.items()])
+                lines.append(f"spotify_downloader_{name}{{{labels}}} {value}")
+
+        with self.lock:
+            stages = {stage: dict(totals) for stage, totals in self.stages.items()}
+        metric("stage_seconds_total", "counter", "Time spent per pipeline stage.",
+               [({'stage': stage}, round(totals['seconds'], 4)) for stage, totals in stages.items()])
+        metric("stage_events_total", "counter", "Timed events per pipeline stage.",
+               [({'stage': stage}, totals['count']) for stage, totals in stages.items()])
+        metric("stage_bytes_total", "counter", "Bytes handled per pipeline stage.",
+               [({'stage': stage}, totals['bytes']) for stage, totals in stages.items()])
+        metric("tracks_total", "counter", "Finished tracks by result.",
+               [({'result': key}, progress[key]) for key in ('downloaded', 'failed', 'cancelled')])
+        tracks_per_minute, mb_per_second, eta = self.throughput(progress['completed'], progress['total'] or progress['loaded'])
+        metric("tracks_per_minute", "gauge", "Average track throughput of the run.", [({}, round(tracks_per_minute, 3))])
+        metric("download_bytes_per_second", "gauge", "Average download throughput of the run.", [({}, round(mb_per_second * 1e6))])
+        metric("run_seconds", "gauge", "Time since the run started.", [({}, round(time.monotonic() - self.started, 3))])
+        temp_path = self.prometheus_path + ".tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(temp_path, self.prometheus_path)
+        except OSError as e:
+            print(f"Could not write metrics file '{self.prometheus_path}': {e}", file=sys.stderr)
+
+    def close(self, progress=None):
+        if progress is not None:
+            self.export_prometheus(progress)
+        with self.lock:
+            if self.events_file:
+                self.events_file.close()
+                self.events_file = None
+
+# --- Batch Scheduling ---
+class PlaylistRun:
+    """One playlist within a run: its output folder, sync manifest, job journal and progress."""
+
+    def __init__(self, playlist_id, priority=1):
+        self.playlist_id = playlist_id
+        self.priority = max(priority, 1)
+        self.name = playlist_id
+        self.snapshot_id = None
+        self.output_dir = None
+        self.manifest = None
+        self.journal = None
+        self.index = None  # DirectoryIndex of output_dir
+        self.tracks = []  # Only filled for batch runs, which expand every playlist up front
+        self.progress = new_progress()
+
+def new_progress():
+    return {'loaded': 0, 'total': None, 'fetch_done': False, 'fetch_error': False, 'seen_ids': set(),
+            'completed': 0, 'downloaded': 0, 'failed': 0, 'cancelled': 0, 'partial': False}
+
+def interleave_playlists(runs):
+    """Yields each unique track of the runs once, as a list of (run, track) pairs for every playlist containing it.
+
+    Playlists take turns by stride scheduling: the playlist with the lowest pass value goes next and
+    each turn advances its pass by 1 / priority, so a priority 2 playlist gets twice as many turns
+    as a priority 1 playlist. A track shared by several playlists is scheduled at the first turn
+    that reaches it, together with all of its other playlists.
+    """
+    owners = {}
+    for run in runs:
+        for track in run.tracks:
+            owners.setdefault(track_key(track), []).append((run, track))
+    scheduled = set()
+    positions = [0] * len(runs)
+    turns = [(0.0, order) for order, run in enumerate(runs) if run.tracks]
+    heapq.heapify(turns)
+    while turns:
+        pass_value, order = heapq.heappop(turns)
+        run = runs[order]
+        while positions[order] < len(run.tracks):
+            key = track_key(run.tracks[positions[order]])
+            positions[order] += 1
+            if key not in scheduled:
+                scheduled.add(key)
+                yield owners[key]
+                break
+        if positions[order] < len(run.tracks):
+            heapq.heappush(turns, (pass_value + 1 / run.priority, order))
+
+# --- Download Engine ---
+class DownloadEngine:
+    """Fetches playlists and downloads their tracks, independent of any user interface.
+
+    Progress is reported as (message_type, data) tuples put on msg_queue:
+    ("log", text), ("status", text), ("output_dir", path) and finally ("finished", success).
+    Set cancel_event to stop a running download; tracks that have not started are skipped.
+    """
+
+    def __init__(self, sp, msg_queue):
+        self.sp = sp
+        self.msg_queue = msg_queue
+        self.spotify_limiter = create_spotify_limiter()  # Shared across runs so one backoff covers every fetch
+        self.youtube_limiter = None
+        self.cancel_event = threading.Event()
+        self.progress_lock = threading.Lock()
+        self.last_download_path = None
+        self.downloader = None
+        self.downloader_factory = create_downloader  # Called with the backend name at the start of each run
+        self.resolution_cache = None
+        self.use_content_store = USE_CONTENT_STORE
+        self.content_store = None
+        self.output_format = DEFAULT_OUTPUT_FORMAT
+        self.split_transcode = SPLIT_TRANSCODE
+        self.transcode_workers = TRANSCODE_WORKERS
+        self.transcoder = None
+        self.use_journal = USE_JOURNAL
+        self.collect_metrics = COLLECT_METRICS
+        self.metrics_dir = METRICS_DIR
+        self.metrics = None
+        self.rank_candidates = RANK_CANDIDATES
+        self.flagged_tracks = []
+        self.batch_progress = None  # Totals across all playlists while a batch runs
+
+    def run_download_process(self, playlist_id, search_suffix=DEFAULT_SEARCH_SUFFIX, max_workers=DEFAULT_MAX_WORKERS,
+                             backend=DEFAULT_BACKEND, sync=False, prune=False, output_format=DEFAULT_OUTPUT_FORMAT,
+                             retry_failed=False):
+        """Downloads one playlist. Returns True if every track was downloaded or skipped.
+
+        With retry_failed=True only the tracks that failed in the previous run (according to the
+        job journal) are downloaded again, without fetching the playlist.
+        """
+        run = PlaylistRun(playlist_id)
+        try:
+            # Check the snapshot (and the journal) before opening anything, so an unchanged playlist finishes instantly.
+            if not self.prepare_playlist(run, search_suffix, sync, output_format):
+                self.msg_queue.put(("finished", True))
+                return True
+
+            retry_tracks = None
+            if retry_failed:
+                if not run.journal:
+                    self.msg_queue.put(("log", "No job journal from a previous run. Downloading the whole playlist."))
+                else:
+                    retry_tracks = run.journal.failed_tracks()
+                    if not retry_tracks:
+                        self.msg_queue.put(("log", "No failed tracks to retry."))
+                        self.msg_queue.put(("finished", True))
+                        return True
+                    self.msg_queue.put(("log", f"Retrying {len(retry_tracks)} failed tracks from the previous run."))
+            run.progress['partial'] = retry_tracks is not None
+            if not self.open_resources(backend, max_workers, output_format, playlist_id):
+                self.msg_queue.put(("finished", False))
+                return False
+
+            if retry_tracks is None:
+                self.msg_queue.put(("log", f"Fetching tracks for playlist ID: {playlist_id} ('{run.name}')"))
+                self.msg_queue.put(("status", f"Fetching tracks..."))
+
+            # Tracks stream from the playlist fetcher into a bounded buffer, so downloads start with the
+            # first page and memory stays flat no matter how large the playlist is.
+            track_buffer = queue.Queue(maxsize=max(TRACK_BUFFER_SIZE, max_workers * 2))
+            self.msg_queue.put(("log", f"Starting download process into '{run.output_dir}' ({max_workers} parallel)..."))
+            producer = threading.Thread(target=self.produce_tracks, args=(run, track_buffer, max_workers, retry_tracks), daemon=True)
+            producer.start()
+            self.run_workers(track_buffer, search_suffix, max_workers)
+            producer.join()
+            if self.transcoder:
+                self.msg_queue.put(("status", "Finishing conversions..."))
+                self.transcoder.finish()
+
+            if run.progress['loaded'] == 0:
+                self.msg_queue.put(("log", "No tracks found or unable to fetch playlist details."))
+                self.msg_queue.put(("finished", False))
+                return False
+
+            self.msg_queue.put(("log", "\n--- Download Summary ---"))
+            success = self.finish_playlist(run, search_suffix, prune)
+            self.log_run_summary(run.progress)
+            self.msg_queue.put(("finished", success))
+            return success
+
+        except Exception as e:
+            self.report_unexpected_error(e)
+            return False
+        finally:
+            if run.journal:
+                run.journal.close()
+            self.close_resources(run.progress)
+
+    def run_batch(self, playlists, search_suffix=DEFAULT_SEARCH_SUFFIX, max_workers=DEFAULT_MAX_WORKERS,
+                  backend=DEFAULT_BACKEND, sync=False, prune=False, output_format=DEFAULT_OUTPUT_FORMAT, user_ids=()):
+        """Downloads many playlists through one scheduler. Returns True if every track of every playlist succeeded.
+
+        playlists holds playlist IDs or (playlist_id, priority) pairs; the public playlists of each
+        user in user_ids are added with priority 1. Every playlist is expanded up front, each unique
+        track is downloaded once and then placed into every playlist folder that contains it.
+        """
+        self.batch_progress = new_progress()
+        runs = []
+        try:
+            entries = [entry if isinstance(entry, tuple) else (entry, 1) for entry in playlists]
+            for user_id in user_ids:
+                entries += [(playlist_id, 1) for playlist_id in self.fetch_user_playlists(user_id)]
+            seen_playlists = set()
+            for playlist_id, priority in entries:
+                if playlist_id not in seen_playlists:
+                    seen_playlists.add(playlist_id)
+                    runs.append(PlaylistRun(playlist_id, priority))
+
+            prepared_runs, active_runs, unchanged_runs, failed_runs = [], [], [], []
+            for number, run in enumerate(runs, 1):
+                if self.cancel_event.is_set():
+                    break
+                self.msg_queue.put(("log", f"\n=== Playlist {number}/{len(runs)}: {run.playlist_id} ==="))
+                if self.prepare_playlist(run, search_suffix, sync, output_format):
+                    prepared_runs.append(run)
+                else:
+                    unchanged_runs.append(run)
+
+            # Resources are only opened when some playlist has work, so a batch of unchanged playlists finishes instantly.
+            if prepared_runs:
+                if not self.open_resources(backend, max_workers, output_format, "batch"):
+                    self.msg_queue.put(("finished", False))
+                    return False
+                for run in prepared_runs:
+                    if self.cancel_event.is_set():
+                        break
+                    if self.expand_playlist(run):
+                        active_runs.append(run)
+                    elif not self.cancel_event.is_set():
+                        failed_runs.append(run)
+                placements = sum(len(run.tracks) for run in active_runs)
+                unique_tracks = len({track_key(track) for run in active_runs for track in run.tracks})
+                self.batch_progress.update(loaded=placements, total=placements, fetch_done=True)
+                self.msg_queue.put(("log", f"\n{placements} tracks in {len(active_runs)} playlists, {unique_tracks} unique. "
+                                           f"Starting downloads ({max_workers} parallel)..."))
+
+                track_buffer = queue.Queue(maxsize=max(TRACK_BUFFER_SIZE, max_workers * 2))
+                producer = threading.Thread(target=self.schedule_batch, args=(active_runs, track_buffer, max_workers), daemon=True)
+                producer.start()
+                self.run_workers(track_buffer, search_suffix, max_workers)
+                producer.join()
+                if self.transcoder:
+                    self.msg_queue.put(("status", "Finishing conversions..."))
+                    self.transcoder.finish()
+
+            self.msg_queue.put(("log", "\n--- Batch Summary ---"))
+            # Unchanged playlists count as synced; only playlists that could not be loaded or were empty fail.
+            success = not self.cancel_event.is_set() and len(active_runs) + len(unchanged_runs) == len(runs)
+            for run in active_runs:
+                self.msg_queue.put(("log", f"\n'{run.name}':"))
+                success = self.finish_playlist(run, search_suffix, prune) and success
+            if unchanged_runs:
+                self.msg_queue.put(("log", f"\nUnchanged since the last sync: {len(unchanged_runs)} playlists"))
+            for run in failed_runs:
+                reason = "could not be loaded" if run.progress['fetch_error'] else "has no tracks"
+                self.msg_queue.put(("log", f"\n'{run.name}': {reason}."))
+            self.log_run_summary(self.batch_progress)
+            self.msg_queue.put(("finished", success))
+            return success
+
+        except Exception as e:
+            self.report_unexpected_error(e)
+            return False
+        finally:
+            for run in runs:
+                if run.journal:
+                    run.journal.close()
+            self.close_resources(self.batch_progress)
+            self.batch_progress = None
+
+    def open_resources(self, backend, max_workers, output_format, metrics_label):
+        """Creates the downloader and the caches, stores and stages shared by every playlist of a run."""
+        self.output_format = output_format
+        self.flagged_tracks = []
+        try:
+            self.downloader = self.downloader_factory(backend)
+        except FileNotFoundError as e:
+            self.msg_queue.put(("log", f"Error: {e}"))
+            return False
+        self.msg_queue.put(("log", f"Using download engine: {self.downloader.name}"))
+        # Start at half the requested parallelism; the limiter grows it while YouTube stays healthy.
+        self.youtube_limiter = AdaptiveLimiter("YouTube", YOUTUBE_REQUESTS_PER_SECOND, YOUTUBE_MAX_REQUESTS_PER_SECOND,
+                                               max(1, max_workers // 2), max_workers)
+        if USE_RESOLUTION_CACHE:
+            try:
+                self.resolution_cache = ResolutionCache()
+            except sqlite3.Error as e:
+                self.msg_queue.put(("log", f"Resolution cache unavailable ({e}). Every track will be searched."))
+        if self.use_content_store:
+            try:
+                self.content_store = ContentStore(output_format=output_format)
+            except OSError as e:
+                self.msg_queue.put(("log", f"Content store unavailable ({e}). Tracks will be downloaded per playlist."))
+        if self.collect_metrics:
+            try:
+                if self.metrics_dir:
+                    os.makedirs(self.metrics_dir, exist_ok=True)
+                self.metrics = RunMetrics(metrics_label, os.path.join(self.metrics_dir, METRICS_JSONL_FILE),
+                                          os.path.join(self.metrics_dir, METRICS_PROM_FILE))
+            except OSError as e:
+                self.msg_queue.put(("log", f"Metrics unavailable ({e})."))
+        if self.split_transcode and output_format == OUTPUT_MP3:
+            self.transcoder = TranscodeStage(self.msg_queue, self.transcode_workers, metrics=self.metrics,
+                                             cancel_event=self.cancel_event)
+            self.msg_queue.put(("log", f"Converting to MP3 in a separate stage with {self.transcoder.workers} ffmpeg workers."))
+        return True
+
+    def close_resources(self, progress):
+        if self.transcoder:
+            self.transcoder.close()
+            self.transcoder = None
+        if self.downloader:
+            self.downloader.close()
+            self.downloader = None
+        if self.resolution_cache:
+            self.resolution_cache.close()
+            self.resolution_cache = None
+        if self.metrics:
+            self.metrics.close(progress)
+            self.metrics = None
+        self.content_store = None
+        self.youtube_limiter = None
+
+    def report_unexpected_error(self, error):
+        self.msg_queue.put(("log", f"An unexpected error occurred: {error}"))
+        self.msg_queue.put(("status", "Error occurred"))
+        if self.last_download_path and not os.path.exists(self.last_download_path):
+            self.last_download_path = None
+            self.msg_queue.put(("output_dir", None))
+        self.msg_queue.put(("finished", False))
+
+    def prepare_playlist(self, run, search_suffix, sync, output_format):
+        """Looks up the playlist and sets up its folder, manifest and journal. Returns False if a sync finds nothing to do."""
+        self.msg_queue.put(("status", "Fetching playlist name..."))
+        playlist_info = self.fetch_playlist_info(run.playlist_id)
+        run.name = playlist_info['name']
+        run.snapshot_id = playlist_info['snapshot_id']
+        run.output_dir = os.path.join(BASE_OUTPUT_DIR, sanitize_filename(run.name))
+        self.last_download_path = run.output_dir
+        self.msg_queue.put(("output_dir", run.output_dir))
+
+        self.create_output_directory(run.output_dir)
+
+        if sync:
+            run.manifest = PlaylistManifest(run.output_dir)
+            if run.manifest.is_unchanged(run.playlist_id, run.snapshot_id, search_suffix, output_format):
+                self.msg_queue.put(("log", "Playlist unchanged since the last sync. Nothing to do."))
+                return False
+
+        if self.use_journal:
+            self.open_journal(run, search_suffix, output_format)
+
+        run.index = DirectoryIndex(run.output_dir)
+        # File names claimed in earlier runs keep their owners, so a track added in front of a
+        # colliding one can never take over its file.
+        if run.manifest:
+            for track_id, filename in run.manifest.files().items():
+                run.index.claim(os.path.splitext(filename)[0], track_id)
+        if run.journal:
+            for key, filename_base in run.journal.files().items():
+                run.index.claim(filename_base, key)
+        return True
+
+    def finish_playlist(self, run, search_suffix, prune):
+        """Completes the sync manifest and logs the playlist's counts. Returns True if every track succeeded."""
+        progress = run.progress
+        if run.manifest:
+            self.finish_sync(run, search_suffix, prune)
+        self.msg_queue.put(("log", f"Successfully downloaded/skipped: {progress['downloaded']} tracks"))
+        self.msg_queue.put(("log", f"Failed: {progress['failed']} tracks"))
+        if progress['fetch_error']:
+            self.msg_queue.put(("log", f"Warning: the playlist could not be fetched completely (loaded {progress['loaded']}"
+                                       f"{' of ' + str(progress['total']) if progress['total'] else ''} tracks)."))
+        if progress['cancelled']:
+            self.msg_queue.put(("log", f"Cancelled: {progress['cancelled']} tracks"))
+        return (progress['failed'] == 0 and progress['cancelled'] == 0 and not progress['fetch_error']
+                and not self.cancel_event.is_set())
+
+    def log_run_summary(self, progress):
+        if self.flagged_tracks:
+            self.msg_queue.put(("log", f"Not downloaded because no search result matched well enough ({len(self.flagged_tracks)}):"))
+            for label in self.flagged_tracks:
+                self.msg_queue.put(("log", f"  {label}"))
+        if self.resolution_cache:
+            cache_stats = self.resolution_cache.stats()
+            self.msg_queue.put(("log", f"Resolution cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses"))
+        if self.content_store:
+            store_stats = self.content_store.stats()
+            self.msg_queue.put(("log", f"Content store: {store_stats['reused']} tracks reused, {store_stats['stored']} newly stored"))
+        if self.metrics:
+            tracks_per_minute, mb_per_second, _ = self.metrics.throughput(progress['completed'], progress['completed'])
+            self.msg_queue.put(("log", f"Throughput: {tracks_per_minute:.1f} tracks/min, {mb_per_second:.2f} MB/s downloaded"))
+            stage_summary = self.metrics.summary()
+            if stage_summary:
+                self.msg_queue.put(("log", f"Time per stage: {stage_summary}"))
+        self.msg_queue.put(("log", "Download process finished."))
+
+    def finish_sync(self, run, search_suffix, prune):
+        """Prunes removed tracks and saves the manifest. The snapshot is only recorded for complete runs."""
+        progress = run.progress
+        complete = not progress['fetch_error'] and not progress['partial'] and not self.cancel_event.is_set()
+        if complete:
+            removed = run.manifest.removed_tracks(progress['seen_ids'])
+            for track_id, entry in removed.items():
+                run.manifest.remove(track_id, delete_file=prune)
+                if prune:
+                    self.msg_queue.put(("log", f"Removed (no longer in playlist): '{entry['file']}'"))
+            if removed and not prune:
+                self.msg_queue.put(("log", f"{len(removed)} tracks are no longer in the playlist (kept on disk)."))
+        fully_synced = complete and progress['failed'] == 0 and progress['cancelled'] == 0
+        try:
+            run.manifest.save(run.playlist_id, run.snapshot_id if fully_synced else None, search_suffix, self.output_format)
+        except OSError as e:
+            self.msg_queue.put(("log", f"Could not write sync manifest: {e}"))
+
+    def open_journal(self, run, search_suffix, output_format):
+        try:
+            run.journal = JobJournal(run.output_dir, run.playlist_id, search_suffix, output_format)
+        except OSError as e:
+            self.msg_queue.put(("log", f"Job journal unavailable ({e}). An interrupted run will start over."))
+            return
+        counts = run.journal.counts()
+        if counts:
+            interrupted = counts[JOB_PENDING] + counts[JOB_DOWNLOADING] + counts[JOB_RESOLVED]
+            self.msg_queue.put(("log", f"Resuming previous run: {counts[JOB_DONE]} done, {counts[JOB_FAILED]} failed, "
+                                       f"{interrupted} not finished."))
+
+    def fetch_playlist_info(self, playlist_id):
+        try:
+            playlist_info = self.spotify_limiter.call(self.sp.playlist, playlist_id, fields='name,snapshot_id')
+            playlist_name = playlist_info.get('name', playlist_id)
+            self.msg_queue.put(("log", f"Found playlist: '{playlist_name}'"))
+            return {'name': playlist_name, 'snapshot_id': playlist_info.get('snapshot_id')}
+        except Exception as e:
+            self.msg_queue.put(("log", f"Error fetching playlist name: {e}. Using Playlist ID instead."))
+            return {'name': playlist_id, 'snapshot_id': None}
+
+    def fetch_user_playlists(self, user_id):
+        """Returns the IDs of a user's public playlists (the client credentials flow can't see private ones)."""
+        playlist_ids = []
+        try:
+            results = self.spotify_limiter.call(self.sp.user_playlists, user_id, limit=50)
+            while results:
+                playlist_ids += [playlist['id'] for playlist in results['items'] if playlist and playlist.get('id')]
+                results = self.spotify_limiter.call(self.sp.next, results) if results['next'] else None
+        except Exception as e:
+            self.msg_queue.put(("log", f"Error fetching the playlists of user '{user_id}': {e}"))
+        self.msg_queue.put(("log", f"User '{user_id}' has {len(playlist_ids)} public playlists."))
+        return playlist_ids
+
+    def create_output_directory(self, directory_path):
+        try:
+            os.makedirs(directory_path, exist_ok=True)
+            self.msg_queue.put(("log", f"Downloads will be saved to: '{directory_path}'"))
+        except OSError as e:
+            self.msg_queue.put(("log", f"Error creating directory '{directory_path}': {e}. Downloads might fail or save elsewhere."))
+
+    def get_playlist_tracks(self, playlist_id):
+        return list(self.iter_playlist_tracks(playlist_id))
+
+    def iter_playlist_tracks(self, playlist_id, on_total=None, parallel=PARALLEL_PAGE_FETCH, on_error=None):
+        """Yields tracks page by page as they arrive from the Spotify API.
+
+        With parallel=True pages are fetched concurrently by offset; otherwise the 'next' links are followed.
+        Throttled and transient failures are retried; if the fetch still fails, on_error is called with
+        the exception, or the exception is raised when no on_error is given.
+        """
+        loaded = 0
+        try:
+            results = fetch_playlist_page(self.sp, playlist_id, 0, limiter=self.spotify_limiter, metrics=self.metrics)
+            if on_total and results.get('total') is not None:
+                on_total(results['total'])
+            if parallel:
+                pages = iter_playlist_pages_parallel(self.sp, playlist_id, first_page=results, limiter=self.spotify_limiter,
+                                                     metrics=self.metrics)
+            else:
+                pages = self.iter_playlist_pages_sequential(results)
+            for page in pages:
+                if loaded:
+                    self.msg_queue.put(("status", f"Fetching tracks... (Loaded {loaded})"))
+                for item in page['items']:
+                    track = parse_track_item(item)
+                    if track:
+                        loaded += 1
+                        yield track
+        except Exception as e:
+            self.msg_queue.put(("log", f"Error fetching playlist tracks: {e}"))
+            if not on_error:
+                raise
+            on_error(e)
+
+    def iter_playlist_pages_sequential(self, results):
+        while results:
+            yield results
+            if not results['next']:
+                break
+            started = time.perf_counter()
+            results = self.spotify_limiter.call(self.sp.next, results)
+            if self.metrics:
+                self.metrics.record(STAGE_FETCH_PAGE, time.perf_counter() - started)
+
+    def expand_playlist(self, run):
+        """Fetches every track of a batch playlist up front. Returns True if there is anything to download."""
+        progress = run.progress
+
+        def on_error(error):
+            progress['fetch_error'] = True
+
+        self.msg_queue.put(("status", f"Fetching tracks of '{run.name}'..."))
+        for track in self.iter_playlist_tracks(run.playlist_id, on_error=on_error):
+            if self.cancel_event.is_set():
+                break
+            self.claim_filename(run, track)
+            if run.journal and not run.journal.get(track):
+                run.journal.record(track, JOB_PENDING, sync=False)
+            progress['loaded'] += 1
+            track['index'] = progress['loaded']
+            if track['id']:
+                progress['seen_ids'].add(track['id'])
+            run.tracks.append(track)
+        progress['total'] = progress['loaded']
+        progress['fetch_done'] = True
+        if self.cancel_event.is_set():
+            return False
+        if not run.tracks:
+            self.msg_queue.put(("log", f"'{run.name}': no tracks found or unable to fetch playlist details."))
+            return False
+        self.msg_queue.put(("log", f"'{run.name}' has {len(run.tracks)} tracks (priority {run.priority})."))
+        return True
+
+    def schedule_batch(self, runs, track_buffer, consumer_count):
+        """Producer stage of a batch: feeds the interleaved, deduplicated tracks into the buffer, then one stop marker per worker."""
+        try:
+            for owners in interleave_playlists(runs):
+                if self.cancel_event.is_set():
+                    break
+                track_buffer.put(owners)
+        finally:
+            for _ in range(consumer_count):
+                track_buffer.put(None)
+
+    def produce_tracks(self, run, track_buffer, consumer_count, tracks=None):
+        """Producer stage: feeds fetched tracks (or the given ones) into the bounded buffer, then one stop marker per worker."""
+        progress = run.progress
+
+        def on_total(total):
+            progress['total'] = total
+            self.msg_queue.put(("log", f"Playlist has {total} tracks. Downloads start as pages arrive."))
+
+        def on_error(error):
+            progress['fetch_error'] = True
+
+        if tracks is None:
+            tracks = self.iter_playlist_tracks(run.playlist_id, on_total, on_error=on_error)
+        else:
+            progress['total'] = len(tracks)
+        try:
+            for track in tracks:
+                if self.cancel_event.is_set():
+                    break
+                self.claim_filename(run, track)
+                if run.journal and not run.journal.get(track):
+                    run.journal.record(track, JOB_PENDING, sync=False)
+                with self.progress_lock:
+                    progress['loaded'] += 1
+                    track['index'] = progress['loaded']
+                    if track['id']:
+                        progress['seen_ids'].add(track['id'])
+                track_buffer.put([(run, track)])
+        finally:
+            progress['fetch_done'] = True
+            for _ in range(consumer_count):
+                track_buffer.put(None)
+
+    def claim_filename(self, run, track):
+        """Gives the track its file name in the playlist folder. Claims happen in playlist order, so collisions resolve the same way every run."""
+        filename_base = track_filename_base(track['artist'], track['name'])
+        track['filename'] = run.index.claim(filename_base, track_key(track))
+        if track['filename'] != filename_base:
+            self.msg_queue.put(("log", f"'{track['artist']} - {track['name']}' has the same file name as another track; "
+                                       f"saving it as '{track['filename']}'."))
+
+    def run_workers(self, track_buffer, search_suffix, max_workers):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            workers = [executor.submit(self.download_worker, track_buffer, search_suffix) for _ in range(max_workers)]
+            # Propagate the first fatal error (e.g. yt-dlp missing) once every worker has drained.
+            for worker in workers:
+                worker.result()
+
+    def download_worker(self, track_buffer, search_suffix):
+        """Consumer stage: downloads tracks from the buffer until it receives a stop marker.
+
+        Each entry lists every (run, track) pair that needs the same song. The first one is
+        downloaded, the others are placed from its file once it is done.
+        """
+        error = None
+        while True:
+            owners = track_buffer.get()
+            if owners is None:
+                break
+            (run, track), others = owners[0], owners[1:]
+            try:
+                success = self.download_track_job(run, track, search_suffix)
+            except Exception as e:
+                # Keep draining so the producer never blocks on a full buffer; re-raised below.
+                if error is None:
+                    error = e
+                self.cancel_event.set()
+                success = None
+            self.on_result(success, lambda success, run=run: self.record_result(success, run))
+            if others:
+                self.on_result(success, lambda success, run=run, track=track, others=others:
+                               self.place_shared_track(success, run, track, others, search_suffix))
+        if error is not None:
+            raise error
+
+    def on_result(self, success, callback):
+        if isinstance(success, concurrent.futures.Future):
+            # The track is still being converted; handle it once the transcode stage is done with it.
+            success.add_done_callback(lambda future: callback(self.future_success(future)))
+        else:
+            callback(success)
+
+    def place_shared_track(self, success, source_run, source_track, others, search_suffix):
+        """Places a track that was downloaded for source_run into the other playlists that contain it."""
+        source_file = None
+        if success:
+            source_file = source_run.index.find(track_output_base(source_track), output_extensions(self.output_format))
+        for run, track in others:
+            if not success:
+                # The song failed or was cancelled once already; don't search for it again per playlist.
+                if success is False and run.journal:
+                    run.journal.record(track, JOB_FAILED)
+                self.record_result(success, run)
+                continue
+            try:
+                result = self.download_track_job(run, track, search_suffix, source_file=source_file)
+            except Exception as e:
+                self.msg_queue.put(("log", f"An unexpected error occurred while placing '{track['artist']} - {track['name']}': {e}"))
+                result = False
+            self.on_result(result, lambda result, run=run: self.record_result(result, run))
+
+    def future_success(self, future):
+        error = future.exception()
+        if error is not None:
+            self.msg_queue.put(("log", f"An unexpected error occurred while finishing a track: {error}"))
+            return False
+        return future.result()
+
+    def record_result(self, success, run):
+        progress = self.batch_progress or run.progress
+        with self.progress_lock:
+            for counts in {id(run.progress): run.progress, id(progress): progress}.values():
+                counts['completed'] += 1
+                if success is None:
+                    counts['cancelled'] += 1
+                elif success:
+                    counts['downloaded'] += 1
+                else:
+                    counts['failed'] += 1
+            completed, failed = progress['completed'], progress['failed']
+            total = progress['loaded'] if progress['fetch_done'] else (progress['total'] or progress['loaded'])
+        if not self.cancel_event.is_set():
+            throughput = f" | {self.metrics.status_suffix(completed, total)}" if self.metrics else ""
+            self.msg_queue.put(("status", f"Downloading... {completed}/{total} done ({failed} failed){throughput}"))
+        if self.metrics:
+            self.metrics.maybe_export(progress)
+
+    def download_track_job(self, run, track, search_suffix, source_file=None):
+        """Runs a single download inside the worker pool.
+
+        With source_file the track was already downloaded for another playlist and is linked from there.
+        Returns None if the run was cancelled before it started, otherwise the success flag or,
+        while the track still waits for the transcode stage, a Future that resolves to it.
+        """
+        if self.cancel_event.is_set():
+            return None
+        output_directory, output_filename_base = run.output_dir, track_output_base(track)
+        manifest, journal, index = run.manifest, run.journal, run.index
+        total = run.progress['total'] or '?'
+        playlist_label = f"'{run.name}' " if self.batch_progress else ""
+        self.msg_queue.put(("log", f"\n--- {playlist_label}Track {track['index']}/{total}: {track['artist']} - {track['name']} ---"))
+        if manifest and track['id'] and manifest.has_file(track['id'], index):
+            self.msg_queue.put(("log", "Skipped: already synced."))
+            return True
+        previous_job = {}
+        if journal:
+            previous_job = journal.get(track)
+            if previous_job.get('state') in (JOB_DOWNLOADING, JOB_RESOLVED, JOB_FAILED):
+                self.msg_queue.put(("log", f"Previous attempts: {previous_job['attempts']} (last state: {previous_job['state']})"))
+        if self.content_store and track['id']:
+            success = self.download_track_via_store(run, track, search_suffix, previous_job)
+        else:
+            success = self.resume_job(previous_job, output_directory, output_filename_base, index, track)
+            if success is None and source_file:
+                success = self.place_from_file(source_file, index, track)
+            elif success is None:
+                success = self.download_track(track['artist'], track['name'], output_directory, search_suffix, self.msg_queue,
+                                              track=track, filename_base=output_filename_base, journal=journal, index=index)
+        success = when_done(success, lambda success: self.record_in_index(index, output_filename_base, success))
+        if journal:
+            success = when_done(success, lambda success: self.record_in_journal(journal, track, success))
+        if not manifest or not track['id']:
+            return success
+
+        def record_in_manifest(success):
+            output_filename = index.find(output_filename_base, output_extensions(self.output_format))
+            if success and output_filename:
+                started = time.perf_counter()
+                manifest.record(track['id'], output_filename)
+                if self.metrics:
+                    self.metrics.record(STAGE_FILESYSTEM, time.perf_counter() - started, track=track)
+            return success
+
+        return when_done(success, record_in_manifest)
+
+    def record_in_journal(self, journal, track, success):
+        if success is None:
+            return success
+        job = journal.get(track)
+        if success and job.get('state') == JOB_DONE and job.get('filename') == track.get('filename'):
+            return success  # Skipped, and already recorded as done
+        # Only finishing a download is worth an fsync; a skip that gets lost is simply skipped again.
+        downloaded = job.get('state') in (JOB_DOWNLOADING, JOB_RESOLVED)
+        journal.record(track, JOB_DONE if success else JOB_FAILED, sync=downloaded or not success)
+        return success
+
+    def record_in_index(self, index, filename_base, success):
+        if success and not index.find(filename_base, output_extensions(self.output_format)):
+            # Downloaded or converted just now; the folder index doesn't know the file yet.
+            index.refresh(filename_base, output_extensions(self.output_format))
+        return success
+
+    def place_from_file(self, source_file, index, track):
+        """Links a track another playlist of the batch already downloaded into the folder of index."""
+        output_filename_base = track_output_base(track)
+        existing = index.find(output_filename_base, output_extensions(self.output_format))
+        if existing:
+            self.msg_queue.put(("log", f"Skipped: '{os.path.basename(existing)}' already exists."))
+            return True
+        output_filename = os.path.join(index.directory, output_filename_base + os.path.splitext(source_file)[1])
+        started = time.perf_counter()
+        try:
+            method = link_file(source_file, output_filename)
+        except OSError as e:
+            self.msg_queue.put(("log", f"Error placing '{os.path.basename(output_filename)}' into the playlist folder: {e}"))
+            return False
+        index.add(output_filename)
+        if self.metrics:
+            self.metrics.record(STAGE_FILESYSTEM, time.perf_counter() - started, track=track)
+        self.msg_queue.put(("log", f"Placed: '{os.path.basename(output_filename)}' ({method} from another playlist)"))
+        return True
+
+    def resume_job(self, previous_job, directory, filename_base, index=None, track=None):
+        """Cleans up after an attempt that was interrupted while writing filename_base into directory.
+
+        Incomplete output files are deleted (yt-dlp's own .part files are kept, it resumes them).
+        Audio that was fully downloaded but not yet converted is sent straight to the transcode
+        stage; the Future is returned. Returns None if the track still has to be downloaded.
+        """
+        state = previous_job.get('state')
+        if state == JOB_RESOLVED and self.transcoder and previous_job.get('file') and os.path.exists(previous_job['file']):
+            output_filename = os.path.join(directory, f"{filename_base}.mp3")
+            if os.path.abspath(previous_job['file']) != os.path.abspath(output_filename):
+                self.msg_queue.put(("log", f"Resuming conversion of '{os.path.basename(previous_job['file'])}'."))
+                return self.transcoder.submit(previous_job['file'], output_filename, filename_base, track)
+        if state in (JOB_DOWNLOADING, JOB_RESOLVED):
+            for ext in AUDIO_EXTENSIONS:
+                path = os.path.join(directory, f"{filename_base}.{ext}")
+                try:
+                    os.remove(path)
+                    if index:
+                        index.discard(path)
+                    self.msg_queue.put(("log", f"Removed incomplete file from an interrupted run: '{os.path.basename(path)}'"))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    self.msg_queue.put(("log", f"Could not remove incomplete file '{path}': {e}"))
+        return None
+
+    def download_track_via_store(self, run, track, search_suffix, previous_job=None):
+        """Downloads a track into the content store once and links it into the playlist folder."""
+        store = self.content_store
+        output_directory, journal, index = run.output_dir, run.journal, run.index
+        extensions = output_extensions(self.output_format)
+        output_filename_base = track_output_base(track)
+        store_key = store.key(track['id'], search_suffix)
+
+        # The lock is held until the file is placed, which may happen later on a transcode thread.
+        lock = store.lock_for(track['id'], search_suffix)
+        lock.acquire()
+        try:
+            if index:
+                existing = index.find(output_filename_base, extensions)
+            else:
+                existing = find_audio_file(output_directory, output_filename_base, extensions)
+            if existing:
+                self.msg_queue.put(("log", f"Skipped: '{os.path.basename(existing)}' already exists."))
+                adopted_filename = os.path.join(store.directory, store_key + os.path.splitext(existing)[1])
+                if (not store.index.get(os.path.basename(adopted_filename)) and store.accepts(existing)
+                        and self.wrote_file(run, track, previous_job or {}, existing)):
+                    # Adopt files from earlier runs so other playlists can reuse them.
+                    try:
+                        store.link(existing, adopted_filename)
+                        store.index.add(adopted_filename)
+                    except OSError as e:
+                        self.msg_queue.put(("log", f"Could not add '{os.path.basename(existing)}' to the content store: {e}"))
+                lock.release()
+                return True
+
+            # Clean up before looking in the store, so an incomplete file is never linked into the playlist.
+            resumed = self.resume_job(previous_job or {}, store.directory, store_key, store.index, track)
+            stored_filename = None if resumed is not None else store.find(track['id'], search_suffix, extensions)
+            newly_stored = stored_filename is None
+            if resumed is not None:
+                success = resumed
+            elif newly_stored:
+                success = self.download_track(track['artist'], track['name'], store.directory, search_suffix, self.msg_queue,
+                                              track=track, filename_base=store_key, journal=journal, index=store.index)
+            else:
+                success = True
+
+            def place_from_store(success):
+                if not success:
+                    return success
+                source = stored_filename or store.find(track['id'], search_suffix, extensions)
+                if not source:
+                    # Converted on a transcode thread, so the store index hasn't seen the file yet.
+                    store.index.refresh(store_key, extensions)
+                    source = store.find(track['id'], search_suffix, extensions)
+                if not source:
+                    self.msg_queue.put(("log", f"Warning: '{output_filename_base}' was downloaded but is missing from the store."))
+                    return False
+                with self.progress_lock:
+                    if newly_stored:
+                        store.stored += 1
+                    else:
+                        store.reused += 1
+                output_filename = os.path.join(output_directory, output_filename_base + os.path.splitext(source)[1])
+                started = time.perf_counter()
+                try:
+                    method = store.link(source, output_filename)
+                    if index:
+                        index.add(output_filename)
+                    if self.metrics:
+                        self.metrics.record(STAGE_FILESYSTEM, time.perf_counter() - started, track=track)
+                except OSError as e:
+                    self.msg_queue.put(("log", f"Error placing '{os.path.basename(output_filename)}' into the playlist folder: {e}"))
+                    return False
+                self.msg_queue.put(("log", f"Placed: '{os.path.basename(output_filename)}' ({method} from store)"))
+                return True
+
+            result = when_done(success, place_from_store)
+        except BaseException:
+            lock.release()
+            raise
+        if isinstance(result, concurrent.futures.Future):
+            result.add_done_callback(lambda future: lock.release())
+        else:
+            lock.release()
+        return result
+
+    def wrote_file(self, run, track, previous_job, path):
+        """True if the sync manifest or the job journal shows that this track wrote path.
+
+        Only such files are adopted into the store; a file of the same name may belong to another song.
+        A journal job only counts if it finished a download of its own (it has a video_id), not a skip.
+        """
+        if run.manifest and track['id'] and run.manifest.file(track['id']) == os.path.basename(path):
+            return True
+        filename_base = os.path.splitext(os.path.basename(path))[0]
+        return (previous_job.get('state') == JOB_DONE and 'video_id' in previous_job
+                and normalize_filename(previous_job.get('filename') or '') == normalize_filename(filename_base))
+
+    def download_audio_format(self):
+        """Returns the audio_format yt-dlp should extract for the current output format."""
+        if self.output_format == OUTPUT_REMUX:
+            return "best"
+        if self.output_format == OUTPUT_MP3 and self.transcoder is None:
+            return "mp3"
+        # Native output, or MP3 converted later by the transcode stage.
+        return None
+
+    def fetch_from_youtube(self, downloader, source, output_path_template, audio_format, track=None, journal=None):
+        """Runs one download under the YouTube limiter, retrying 429s and transient network errors.
+
+        The job is journaled as downloading right before, so only a real download can leave files to clean up.
+        """
+        def timed_download():
+            # Timed inside the limiter, so waiting for a slot or a backoff is not counted as download time.
+            started = time.perf_counter()
+            result = downloader.download(source, output_path_template, audio_format)
+            if self.metrics:
+                self.record_download_metrics(result, time.perf_counter() - started, track)
+            return result
+
+        if journal and track:
+            journal.record(track, JOB_DOWNLOADING)
+        if self.youtube_limiter is None:
+            return timed_download()
+        return self.youtube_limiter.call(timed_download, classify=classify_youtube_error)
+
+    def resolve_candidate(self, downloader, search_query, track):
+        """Picks the best of CANDIDATE_COUNT search results by their metadata, before anything is downloaded.
+
+        Returns None if the backend can't search (the first result is downloaded instead) and raises
+        AmbiguousMatchError if no result is a confident match.
+        """
+        if not downloader.supports_search:
+            return None
+
+        def timed_search():
+            started = time.perf_counter()
+            candidates = downloader.search(search_query, CANDIDATE_COUNT)
+            if self.metrics:
+                self.metrics.record(STAGE_RESOLVE, time.perf_counter() - started, track=track)
+            return candidates
+
+        if self.youtube_limiter is None:
+            candidates = timed_search()
+        else:
+            candidates = self.youtube_limiter.call(timed_search, classify=classify_youtube_error)
+        return choose_candidate(track, candidates)
+
+    def record_download_metrics(self, result, seconds, track):
+        try:
+            nbytes = os.path.getsize(result['filepath']) if result['filepath'] else 0
+        except OSError:
+            nbytes = 0
+        download_seconds = result.get('download_seconds')
+        if download_seconds is not None and download_seconds <= seconds:
+            self.metrics.record(STAGE_RESOLVE, seconds - download_seconds, track=track)
+            seconds = download_seconds
+        self.metrics.record(STAGE_DOWNLOAD, seconds, nbytes, track=track)
+
+    def download_track(self, artist, name, output_directory, search_suffix, msg_queue, downloader=None, track=None, filename_base=None,
+                       journal=None, index=None):
+        search_query = f"{artist} - {name}{search_suffix}"
+        output_filename_base = filename_base or track_filename_base(artist, name)
+        output_filename = os.path.join(output_directory, f"{output_filename_base}.mp3")
+        output_path_template = os.path.join(output_directory, f"{output_filename_base}.%(ext)s")
+        extensions = output_extensions(self.output_format)
+
+        if index:
+            existing = index.find(output_filename_base, extensions)
+        else:
+            existing = find_audio_file(output_directory, output_filename_base, extensions)
+        if existing:
+            msg_queue.put(("log", f"Skipped: '{os.path.basename(existing)}' already exists."))
+            return True
+
+        if downloader is None:
+            downloader = self.downloader or SubprocessDownloader()
+        cache = self.resolution_cache if track else None
+        cached = cache.get(track, search_suffix) if cache else None
+        audio_format = self.download_audio_format()
+
+        try:
+            if cached:
+                msg_queue.put(("log", f"Downloading cached match for {artist} - {name}: {cached['title'] or cached['video_id']}"))
+                try:
+                    result = self.fetch_from_youtube(downloader, YOUTUBE_VIDEO_URL.format(video_id=cached['video_id']), output_path_template, audio_format, track, journal)
+                except DownloadError:
+                    msg_queue.put(("log", f"Cached video {cached['video_id']} is no longer available. Searching again."))
+                    cache.invalidate(track, search_suffix)
+                    cached = None
+            if not cached:
+                candidate = self.resolve_candidate(downloader, search_query, track) if self.rank_candidates and track else None
+                if candidate:
+                    msg_queue.put(("log", f"Downloading best match for {artist} - {name}: {candidate['title']} (score {candidate['score']:.2f})"))
+                    source = YOUTUBE_VIDEO_URL.format(video_id=candidate['video_id'])
+                else:
+                    msg_queue.put(("log", f"Searching and downloading: {artist} - {name}"))
+                    source = f"ytsearch1:{search_query}"
+                result = self.fetch_from_youtube(downloader, source, output_path_template, audio_format, track, journal)
+                if cache and result['video_id']:
+                    cache.put(track, search_suffix, result['video_id'], result['title'])
+
+            native_file = result['filepath'] if result['filepath'] and os.path.exists(result['filepath']) else None
+            if journal and track:
+                journal.record(track, JOB_RESOLVED, video_id=result['video_id'], file=native_file)
+            if self.transcoder and native_file and os.path.abspath(native_file) != os.path.abspath(output_filename):
+                msg_queue.put(("log", f"Downloaded audio for '{output_filename_base}', queued for conversion."))
+                return self.transcoder.submit(native_file, output_filename, f"{artist} - {name}", track)
+            downloaded = native_file or find_audio_file(output_directory, output_filename_base, extensions)
+            if downloaded and index:
+                index.add(downloaded)
+            if downloaded or (result['confirmed'] and not self.transcoder):
+                msg_queue.put(("log", f"Downloaded: '{os.path.basename(downloaded) if downloaded else output_filename_base}'"))
+                return True
+            else:
+                msg_queue.put(("log", f"Warning: yt-dlp finished for '{artist} - {name}' but output file not confirmed."))
+                for label, text in result['details']:
+                    if text: msg_queue.put(("log", f"{label}:\n{text}"))
+                return False
+
+        except FileNotFoundError as e:
+            if isinstance(downloader, YoutubeDLDownloader):
+                msg_queue.put(("log", f"Error: {e}"))
+            else:
+                msg_queue.put(("log", f"Error: '{YT_DLP_EXECUTABLE}' not found. Make sure it's in your PATH or the script's directory."))
+            raise RuntimeError("yt-dlp not found")
+        except AmbiguousMatchError as e:
+            msg_queue.put(("log", f"Flagged '{artist} - {name}', not downloaded: {e}."))
+            with self.progress_lock:
+                self.flagged_tracks.append(f"{artist} - {name}")
+            return False
+        except DownloadError as e:
+            msg_queue.put(("log", f"Error downloading '{artist} - {name}'. yt-dlp failed."))
+            msg_queue.put(("log", f"Error message (yt-dlp):\n{str(e)[:500]}..."))
+            return False
+        except Exception as e:
+            msg_queue.put(("log", f"An unexpected error occurred while downloading '{artist} - {name}': {e}"))
+            return False
@@ -1,54 +1,60 @@
 # spotify_to_youtube_gui.py
 # Description: Downloads songs from a Spotify playlist using YouTube and yt-dlp, with a Tkinter GUI.
+#              The download engine itself lives in spotify_to_youtube_core.py.
 # Requirements:
 #   - Python 3.x
-#   - spotipy library (install using: pip install spotipy)
+#   - spotipy library, 2.19 or newer (install using: pip install spotipy)
 #   - python-dotenv library (install using: pip install python-dotenv)
-#   - yt-dlp.exe (should be in the system PATH or the same directory as this script)
+#   - yt-dlp (either the yt-dlp Python package for the in-process engine, install using: pip install yt-dlp,
+#     or yt-dlp.exe in the system PATH or the same directory as this script)
 #   - ffmpeg (required by yt-dlp for audio conversion, should be in PATH or same directory)
 
 import os
-import subprocess
-import time
-import re
 import threading
 import queue
+import atexit
+import collections
+import logging
+import logging.handlers
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, font, Toplevel
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-from dotenv import load_dotenv
-
-# --- Load Environment Variables ---
-load_dotenv()
+from spotify_to_youtube_core import (
+    DEFAULT_BACKEND, DEFAULT_MAX_WORKERS, DEFAULT_OUTPUT_FORMAT, DOWNLOADER_BACKENDS, ENV_FILE, MAX_WORKERS_LIMIT, OUTPUT_FORMATS,
+    SEARCH_SUFFIX_INSTRUMENTAL, SEARCH_SUFFIX_LYRICS, DEFAULT_SEARCH_SUFFIX,
+    DownloadEngine, create_spotify_client, is_valid_credential, parse_playlist_sources,
+)
 
 # --- Configuration ---
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-BASE_OUTPUT_DIR = "Spotify_Downloads"
-ENV_FILE = ".env"
-PLACEHOLDER_VALUES = {None, "", "YOUR_SPOTIFY_CLIENT_ID_HERE", "YOUR_SPOTIFY_CLIENT_SECRET_HERE", "your_key_here"}
+QUEUE_POLL_INTERVAL_MS = 100  # How often queued engine messages are rendered
+MAX_MESSAGES_PER_TICK = 20000  # Bounds the work done per tick; the rest is picked up right after
+LOG_MAX_LINES = 5000  # Older lines are dropped from the log window (the log file keeps everything)
+LOG_FILE = "spotify_downloader.log"
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
 
 # --- Global Spotify Client ---
 sp = None
 
 # --- Helper Functions ---
-def extract_playlist_id(url):
-    """Extracts the playlist ID from various Spotify URL formats."""
-    match = re.search(r'playlist/([a-zA-Z0-9]+)', url)
-    if match:
-        return match.group(1)
-    return None
-
-def sanitize_filename(name):
-    """Removes characters that are invalid for Windows filenames."""
-    sanitized = re.sub(r'[<>:"/\\|?*]', '', name)
-    sanitized = re.sub(r'\s+', ' ', sanitized).strip()
-    return sanitized
-
-def is_valid_credential(value):
-    """Checks if a credential value is present and not a placeholder."""
-    return value not in PLACEHOLDER_VALUES
+def create_file_logger(path=LOG_FILE):
+    """Returns a logger that writes to a rotating log file from a background thread, or None if the file can't be opened."""
+    try:
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8')
+    except OSError as e:
+        print(f"Could not open log file '{path}': {e}")
+        return None
+    file_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger = logging.getLogger("spotify_downloader")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    return logger
 
 def save_credentials_to_env(client_id, client_secret):
     """Saves the provided credentials to the .env file."""
@@ -141,6 +147,12 @@ def prompt_credentials_gui():
         print(f"Error in prompt_credentials_gui: {e}")
         return False
 
+def load_environment(override=False):
+    """Loads the .env file into the environment. python-dotenv is only imported when the file exists."""
+    if os.path.exists(ENV_FILE):
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=ENV_FILE, override=override)
+
 # --- GUI Application Class ---
 class SpotifyDownloaderGUI:
     def __init__(self, root):
@@ -159,36 +171,38 @@ class SpotifyDownloaderGUI:
             self.root.quit()
             return
 
-        self.sp = self.authenticate_spotify()
-        if not self.sp:
-            self.root.quit()
-            return
-
+        self.sp = None  # Set once the background authentication succeeds
         self.download_queue = queue.Queue()
         self.download_thread = None
+        self.pending_runs = collections.deque()  # Runs started while another one was active
+        self.run_active = False  # From start_run until the engine reports "finished" (or the run is cancelled before it starts)
+        self.engine = DownloadEngine(None, self.download_queue)
         self.last_download_path = None
+        self.file_logger = create_file_logger()
 
         self.playlist_url_var = tk.StringVar()
-        self.search_suffix_var = tk.StringVar(value=" lyrics")
+        self.search_suffix_var = tk.StringVar(value=DEFAULT_SEARCH_SUFFIX)
+        self.max_workers_var = tk.IntVar(value=DEFAULT_MAX_WORKERS)
+        self.backend_var = tk.StringVar(value=DEFAULT_BACKEND)
+        self.output_format_var = tk.StringVar(value=DEFAULT_OUTPUT_FORMAT)
+        self.sync_var = tk.BooleanVar(value=False)
+        self.prune_var = tk.BooleanVar(value=False)
+        self.retry_failed_var = tk.BooleanVar(value=False)
         self.status_var = tk.StringVar(value="Status: Idle")
 
         self.setup_gui()
+        self.update_status("Connecting to Spotify...")
+        # The credential check is a network round trip; run it in the background so the window shows up right away.
+        threading.Thread(target=self.authenticate_spotify, args=(CLIENT_ID, CLIENT_SECRET), daemon=True).start()
         self.check_queue()
 
-    def authenticate_spotify(self):
-        global sp, CLIENT_ID, CLIENT_SECRET
+    def authenticate_spotify(self, client_id, client_secret):
+        """Runs on a background thread and reports the result to check_queue as an "auth" message."""
         try:
-            current_client_id = os.getenv("CLIENT_ID")
-            current_client_secret = os.getenv("CLIENT_SECRET")
-            if not is_valid_credential(current_client_id) or not is_valid_credential(current_client_secret):
-                messagebox.showerror("Authentication Error", "Credentials became invalid before authentication.")
-                return None
-
-            client_credentials_manager = SpotifyClientCredentials(client_id=current_client_id, client_secret=current_client_secret)
-            sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
-            sp.categories(limit=1)
+            client = create_spotify_client(client_id, client_secret)
+            client.categories(limit=1)
             print("Successfully authenticated with Spotify API (using public endpoint check).")
-            return sp
+            self.download_queue.put(("auth", (client, None)))
         except Exception as e:
             error_detail = str(e)
             if "invalid client" in error_detail.lower() or "client id" in error_detail.lower():
@@ -197,17 +211,25 @@ class SpotifyDownloaderGUI:
                 error_message = f"Spotify Authentication Failed (401 Unauthorized): Invalid Client ID or Secret.\nPlease verify the credentials in your .env file or re-enter them."
             else:
                 error_message = f"Error authenticating with Spotify: {e}\nCheck your CLIENT_ID, CLIENT_SECRET in .env, and network connection."
+            self.download_queue.put(("auth", (None, error_message)))
+
+    def authentication_finished(self, client, error_message):
+        global sp
+        if error_message:
             messagebox.showerror("Spotify Authentication Failed", error_message)
-            return None
+            self.root.quit()
+            return
+        sp = self.sp = self.engine.sp = client
+        self.update_status("Idle")
 
     def setup_gui(self):
         main_frame = ttk.Frame(self.root, padding="10")
         main_frame.pack(fill=tk.BOTH, expand=True)
 
         main_frame.columnconfigure(1, weight=1)
-        main_frame.rowconfigure(4, weight=1)
+        main_frame.rowconfigure(6, weight=1)
 
-        url_label = ttk.Label(main_frame, text="Spotify Playlist URL:")
+        url_label = ttk.Label(main_frame, text="Spotify Playlist URLs:")
         url_label.grid(row=0, column=0, padx=(0, 5), pady=5, sticky="w")
         url_entry = ttk.Entry(main_frame, textvariable=self.playlist_url_var, width=60)
         url_entry.grid(row=0, column=1, padx=(0, 5), pady=5, sticky="ew")
@@ -215,36 +237,84 @@ class SpotifyDownloaderGUI:
         radio_frame = ttk.Frame(main_frame)
         radio_frame.grid(row=1, column=0, columnspan=2, pady=5, sticky="w")
 
-        lyrics_radio = ttk.Radiobutton(radio_frame, text="Lyrics (Appends 'lyrics' to search)", variable=self.search_suffix_var, value=" lyrics")
+        lyrics_radio = ttk.Radiobutton(radio_frame, text="Lyrics (Appends 'lyrics' to search)", variable=self.search_suffix_var, value=SEARCH_SUFFIX_LYRICS)
         lyrics_radio.pack(side=tk.LEFT, padx=(0, 10))
-        instrumental_radio = ttk.Radiobutton(radio_frame, text="Instrumental (Non lyrics search)", variable=self.search_suffix_var, value="")
+        instrumental_radio = ttk.Radiobutton(radio_frame, text="Instrumental (Non lyrics search)", variable=self.search_suffix_var, value=SEARCH_SUFFIX_INSTRUMENTAL)
         instrumental_radio.pack(side=tk.LEFT)
 
+        options_frame = ttk.Frame(main_frame)
+        options_frame.grid(row=2, column=0, columnspan=2, pady=5, sticky="w")
+
+        workers_label = ttk.Label(options_frame, text="Parallel downloads:")
+        workers_label.pack(side=tk.LEFT, padx=(0, 5))
+        workers_spinbox = ttk.Spinbox(options_frame, from_=1, to=MAX_WORKERS_LIMIT, textvariable=self.max_workers_var, width=4, state="readonly")
+        workers_spinbox.pack(side=tk.LEFT)
+
+        backend_label = ttk.Label(options_frame, text="Download engine:")
+        backend_label.pack(side=tk.LEFT, padx=(20, 5))
+        backend_combobox = ttk.Combobox(options_frame, textvariable=self.backend_var, values=DOWNLOADER_BACKENDS, width=12, state="readonly")
+        backend_combobox.pack(side=tk.LEFT)
+
+        format_label = ttk.Label(options_frame, text="Output:")
+        format_label.pack(side=tk.LEFT, padx=(20, 5))
+        format_combobox = ttk.Combobox(options_frame, textvariable=self.output_format_var, values=OUTPUT_FORMATS, width=8, state="readonly")
+        format_combobox.pack(side=tk.LEFT)
+
+        sync_frame = ttk.Frame(main_frame)
+        sync_frame.grid(row=3, column=0, columnspan=2, pady=5, sticky="w")
+
+        sync_check = ttk.Checkbutton(sync_frame, text="Sync (only download new songs)", variable=self.sync_var)
+        sync_check.pack(side=tk.LEFT, padx=(0, 10))
+        prune_check = ttk.Checkbutton(sync_frame, text="Remove songs no longer in playlist", variable=self.prune_var)
+        prune_check.pack(side=tk.LEFT, padx=(0, 10))
+        retry_check = ttk.Checkbutton(sync_frame, text="Only retry failed songs", variable=self.retry_failed_var)
+        retry_check.pack(side=tk.LEFT)
+
         buttons_frame = ttk.Frame(main_frame)
-        buttons_frame.grid(row=2, column=0, columnspan=2, pady=10, sticky="ew")
+        buttons_frame.grid(row=4, column=0, columnspan=2, pady=10, sticky="ew")
         buttons_frame.columnconfigure(0, weight=1)
         buttons_frame.columnconfigure(1, weight=1)
+        buttons_frame.columnconfigure(2, weight=1)
 
         self.download_button = ttk.Button(buttons_frame, text="Start Download", command=self.start_download_thread)
         self.download_button.grid(row=0, column=0, padx=(0, 5), sticky="ew")
 
+        self.cancel_button = ttk.Button(buttons_frame, text="Cancel", command=self.cancel_download, state=tk.DISABLED)
+        self.cancel_button.grid(row=0, column=1, padx=5, sticky="ew")
+
         self.open_folder_button = ttk.Button(buttons_frame, text="Open Last Download Folder", command=self.open_last_download_folder, state=tk.DISABLED)
-        self.open_folder_button.grid(row=0, column=1, padx=(5, 0), sticky="ew")
+        self.open_folder_button.grid(row=0, column=2, padx=(5, 0), sticky="ew")
 
         log_label = ttk.Label(main_frame, text="Log:")
-        log_label.grid(row=3, column=0, sticky="nw", pady=(5, 0))
+        log_label.grid(row=5, column=0, sticky="nw", pady=(5, 0))
 
         self.log_area = scrolledtext.ScrolledText(main_frame, wrap=tk.WORD, height=15, width=80, state=tk.DISABLED)
         log_font = font.Font(family="Consolas", size=9)
         self.log_area.configure(font=log_font)
-        self.log_area.grid(row=4, column=0, columnspan=2, padx=0, pady=(0, 5), sticky="nsew")
+        self.log_area.grid(row=6, column=0, columnspan=2, padx=0, pady=(0, 5), sticky="nsew")
 
         self.status_label = ttk.Label(main_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
-        self.status_label.grid(row=5, column=0, columnspan=2, sticky="ew", pady=(5, 0))
+        self.status_label.grid(row=7, column=0, columnspan=2, sticky="ew", pady=(5, 0))
 
     def log_message(self, message):
+        self.log_messages([message])
+
+    def log_messages(self, messages):
+        """Appends messages to the log file and, with a single insert, to the log window (capped at LOG_MAX_LINES)."""
+        if not messages:
+            return
+        if self.file_logger:
+            for message in messages:
+                self.file_logger.info(message)
+        # Ring buffer: of a large batch only the lines that will stay visible are inserted.
+        lines = collections.deque(maxlen=LOG_MAX_LINES)
+        for message in messages:
+            lines.extend(message.split("\n"))
         self.log_area.configure(state=tk.NORMAL)
-        self.log_area.insert(tk.END, message + "\n")
+        self.log_area.insert(tk.END, "\n".join(lines) + "\n")
+        excess = int(self.log_area.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+        if excess > 0:
+            self.log_area.delete("1.0", f"{excess + 1}.0")
         self.log_area.configure(state=tk.DISABLED)
         self.log_area.see(tk.END)
 
@@ -252,187 +322,125 @@ class SpotifyDownloaderGUI:
         self.status_var.set(f"Status: {status_text}")
 
     def check_queue(self):
-        try:
-            while True:
+        """Renders everything queued since the last tick: log lines in one insert, only the latest status."""
+        messages = []
+        status = None
+        finished = None
+        backlog = True
+        for _ in range(MAX_MESSAGES_PER_TICK):
+            try:
                 message_type, data = self.download_queue.get_nowait()
-                if message_type == "log":
-                    self.log_message(data)
-                elif message_type == "status":
-                    self.update_status(data)
-                elif message_type == "finished":
-                    self.download_button.config(state=tk.NORMAL)
-                    if self.last_download_path and data:
-                        self.open_folder_button.config(state=tk.NORMAL)
-                    else:
-                        self.open_folder_button.config(state=tk.DISABLED)
-                    self.update_status("Finished" if data else "Finished with errors")
-                    return
-        except queue.Empty:
-            pass
-        self.root.after(100, self.check_queue)
+            except queue.Empty:
+                backlog = False
+                break
+            if message_type == "log":
+                messages.append(data)
+            elif message_type == "status":
+                status = data
+            elif message_type == "output_dir":
+                self.last_download_path = data
+            elif message_type == "auth":
+                self.authentication_finished(*data)
+            elif message_type == "finished":
+                finished = (data,)
+                break
+        self.log_messages(messages)
+        if status is not None:
+            self.update_status(status)
+        if finished is not None:
+            self.download_finished(finished[0])
+            return
+        # If the batch limit was hit more is waiting, so come back right away instead of after the poll interval.
+        self.root.after(1 if backlog else QUEUE_POLL_INTERVAL_MS, self.check_queue)
+
+    def download_finished(self, success):
+        if self.pending_runs and not self.engine.cancel_event.is_set():
+            self.log_message(f"\nFinished {'successfully' if success else 'with errors'}. Starting the next queued run.")
+            self.start_run(*self.pending_runs.popleft())
+            return
+        self.pending_runs.clear()
+        self.run_active = False
+        self.cancel_button.config(state=tk.DISABLED)
+        if self.last_download_path and success:
+            self.open_folder_button.config(state=tk.NORMAL)
+        else:
+            self.open_folder_button.config(state=tk.DISABLED)
+        if self.engine.cancel_event.is_set():
+            self.update_status("Cancelled")
+        else:
+            self.update_status("Finished" if success else "Finished with errors")
 
     def start_download_thread(self):
-        playlist_url = self.playlist_url_var.get().strip()
-        playlist_id = extract_playlist_id(playlist_url)
+        playlist_urls = self.playlist_url_var.get().strip()
+        playlists, user_ids, invalid = parse_playlist_sources(playlist_urls)
 
-        if not playlist_id:
-            messagebox.showerror("Invalid Input", "Please enter a valid Spotify playlist URL.")
+        if invalid or not (playlists or user_ids):
+            messagebox.showerror("Invalid Input", "Please enter valid Spotify playlist or profile URLs, separated by spaces or commas."
+                                 + (f"\n\nNot recognized: {', '.join(invalid)}" if invalid else ""))
             return
 
         if not self.sp:
-            messagebox.showerror("Error", "Spotify client not initialized. Please restart the application.")
+            messagebox.showinfo("Connecting", "Still connecting to Spotify. Please try again in a moment.")
+            return
+
+        try:
+            max_workers = max(1, min(int(self.max_workers_var.get()), MAX_WORKERS_LIMIT))
+        except (tk.TclError, ValueError):
+            max_workers = DEFAULT_MAX_WORKERS
+        search_suffix = self.search_suffix_var.get()
+        backend = self.backend_var.get()
+        output_format = self.output_format_var.get()
+        sync = self.sync_var.get()
+        prune = sync and self.prune_var.get()
+        retry_failed = self.retry_failed_var.get()
+        if retry_failed and (len(playlists) > 1 or user_ids):
+            messagebox.showerror("Invalid Input", "\"Only retry failed songs\" works per playlist. Enter a single playlist URL "
+                                 "or untick it to download several playlists.")
+            return
+
+        if len(playlists) == 1 and not user_ids:
+            run = (self.engine.run_download_process, (playlists[0][0], search_suffix, max_workers, backend, sync, prune, output_format, retry_failed))
+        else:
+            # Several playlists share one scheduler, so songs they have in common are downloaded once.
+            run = (self.engine.run_batch, (playlists, search_suffix, max_workers, backend, sync, prune, output_format, user_ids))
+        if self.run_active:
+            self.pending_runs.append(run + (playlist_urls,))
+            self.log_message(f"Queued: {playlist_urls} (starts when the current run finishes, {len(self.pending_runs)} waiting)")
             return
 
-        self.download_button.config(state=tk.DISABLED)
-        self.open_folder_button.config(state=tk.DISABLED)
         self.log_area.configure(state=tk.NORMAL)
         self.log_area.delete('1.0', tk.END)
         self.log_area.configure(state=tk.DISABLED)
+        self.start_run(*run, playlist_urls)
+
+    def start_run(self, target, args, playlist_urls):
+        self.run_active = True
+        self.engine.cancel_event.clear()
+        self.cancel_button.config(state=tk.NORMAL)
+        self.open_folder_button.config(state=tk.DISABLED)
         self.update_status("Starting...")
-        self.log_message(f"Processing playlist URL: {playlist_url}")
+        self.log_message(f"Processing: {playlist_urls}")
+        self.launch_run(target, args)
 
-        self.download_thread = threading.Thread(target=self.run_download_process, args=(playlist_id,), daemon=True)
+    def launch_run(self, target, args):
+        if self.engine.cancel_event.is_set():
+            self.download_finished(False)  # Cancelled while waiting for the previous run
+            return
+        if self.download_thread and self.download_thread.is_alive():
+            # The engine reports "finished" before it closes its downloader, caches and metrics; check back
+            # until that cleanup is done, so it can't hit the new run's resources and the window stays responsive.
+            self.root.after(QUEUE_POLL_INTERVAL_MS, self.launch_run, target, args)
+            return
+        self.download_thread = threading.Thread(target=target, args=args, daemon=True)
         self.download_thread.start()
-        self.root.after(100, self.check_queue)
-
-    def run_download_process(self, playlist_id):
-        try:
-            self.download_queue.put(("status", "Fetching playlist name..."))
-            playlist_name = self.fetch_playlist_name(playlist_id)
-            sanitized_playlist_name = sanitize_filename(playlist_name)
-            specific_output_dir = os.path.join(BASE_OUTPUT_DIR, sanitized_playlist_name)
-            self.last_download_path = specific_output_dir
-
-            self.create_output_directory(specific_output_dir)
-
-            self.download_queue.put(("log", f"Fetching tracks for playlist ID: {playlist_id} ('{playlist_name}')"))
-            self.download_queue.put(("status", f"Fetching tracks..."))
-            tracks = self.get_playlist_tracks(playlist_id)
-
-            if not tracks:
-                self.download_queue.put(("log", "No tracks found or unable to fetch playlist details."))
-                self.download_queue.put(("finished", False))
-                return
-
-            self.download_queue.put(("log", f"Found {len(tracks)} tracks. Starting download process into '{specific_output_dir}'..."))
-            download_count = 0
-            failed_count = 0
-            search_suffix = self.search_suffix_var.get()
-
-            for i, track in enumerate(tracks, 1):
-                self.download_queue.put(("status", f"Downloading {i}/{len(tracks)}: {track['artist']} - {track['name']}"))
-                self.download_queue.put(("log", f"\n--- Track {i}/{len(tracks)} ---"))
-                success = self.download_track(track['artist'], track['name'], specific_output_dir, search_suffix, self.download_queue)
-                if success:
-                    download_count += 1
-                else:
-                    failed_count += 1
-                self.download_queue.put(("log", "Waiting 1 second..."))
-                time.sleep(1)
+        self.root.after(QUEUE_POLL_INTERVAL_MS, self.check_queue)
 
-            self.download_queue.put(("log", "\n--- Download Summary ---"))
-            self.download_queue.put(("log", f"Successfully downloaded/skipped: {download_count} tracks"))
-            self.download_queue.put(("log", f"Failed: {failed_count} tracks"))
-            self.download_queue.put(("log", "Download process finished."))
-            self.download_queue.put(("finished", failed_count == 0))
-
-        except Exception as e:
-            self.download_queue.put(("log", f"An unexpected error occurred: {e}"))
-            self.download_queue.put(("status", "Error occurred"))
-            self.download_queue.put(("finished", False))
-            if not os.path.exists(getattr(self, 'last_download_path', '')):
-                self.last_download_path = None
-
-    def fetch_playlist_name(self, playlist_id):
-        try:
-            playlist_info = self.sp.playlist(playlist_id, fields='name')
-            playlist_name = playlist_info.get('name', playlist_id)
-            self.download_queue.put(("log", f"Found playlist: '{playlist_name}'"))
-            return playlist_name
-        except Exception as e:
-            self.download_queue.put(("log", f"Error fetching playlist name: {e}. Using Playlist ID instead."))
-            return playlist_id
-
-    def create_output_directory(self, directory_path):
-        try:
-            os.makedirs(directory_path, exist_ok=True)
-            self.download_queue.put(("log", f"Downloads will be saved to: '{directory_path}'"))
-        except OSError as e:
-            self.download_queue.put(("log", f"Error creating directory '{directory_path}': {e}. Downloads might fail or save elsewhere."))
-
-    def get_playlist_tracks(self, playlist_id):
-        tracks = []
-        try:
-            results = self.sp.playlist_items(playlist_id, fields='items(track(name, artists(name))), next')
-            items = results['items']
-            while items:
-                for item in items:
-                    track = item.get('track')
-                    if track and track.get('name') and track.get('artists'):
-                        track_name = track['name']
-                        artist_name = track['artists'][0]['name']
-                        tracks.append({'artist': artist_name, 'name': track_name})
-                if results['next']:
-                    self.download_queue.put(("status", f"Fetching tracks... (Loaded {len(tracks)})"))
-                    results = self.sp.next(results)
-                    items = results['items']
-                else:
-                    items = None
-        except Exception as e:
-            self.download_queue.put(("log", f"Error fetching playlist tracks: {e}"))
-        return tracks
-
-    def download_track(self, artist, name, output_directory, search_suffix, msg_queue):
-        search_query = f"{artist} - {name}{search_suffix}"
-        output_filename_base = sanitize_filename(f"{artist} - {name}")
-        output_filename = os.path.join(output_directory, f"{output_filename_base}.mp3")
-        output_path_template = os.path.join(output_directory, f"{output_filename_base}.%(ext)s")
-
-        if os.path.exists(output_filename):
-            msg_queue.put(("log", f"Skipped: '{output_filename_base}.mp3' already exists."))
-            return True
-
-        msg_queue.put(("log", f"Searching and downloading: {artist} - {name}"))
-
-        command = [
-            "yt-dlp.exe",
-            f"ytsearch1:{search_query}",
-            "-x",
-            "--audio-format", "mp3",
-            "--audio-quality", "0",
-            "-o", output_path_template,
-            "--no-playlist",
-            "--encoding", "utf-8"
-        ]
-
-        try:
-            startupinfo = None
-            if os.name == 'nt':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-
-            result = subprocess.run(command, check=True, capture_output=True, text=True, encoding='utf-8', errors='ignore', startupinfo=startupinfo)
-            if "has already been downloaded" in result.stdout or "Destination:" in result.stdout or os.path.exists(output_filename):
-                msg_queue.put(("log", f"Downloaded: '{output_filename_base}.mp3'"))
-                return True
-            else:
-                msg_queue.put(("log", f"Warning: yt-dlp finished for '{artist} - {name}' but output file not confirmed."))
-                if result.stdout: msg_queue.put(("log", f"yt-dlp stdout:\n{result.stdout}"))
-                if result.stderr: msg_queue.put(("log", f"yt-dlp stderr:\n{result.stderr}"))
-                return False
-
-        except FileNotFoundError:
-            msg_queue.put(("log", f"Error: 'yt-dlp.exe' not found. Make sure it's in your PATH or the script's directory."))
-            raise RuntimeError("yt-dlp not found")
-        except subprocess.CalledProcessError as e:
-            msg_queue.put(("log", f"Error downloading '{artist} - {name}'. yt-dlp failed."))
-            stderr_output = e.stderr if e.stderr else "No stderr output."
-            msg_queue.put(("log", f"Error message (yt-dlp):\n{stderr_output[:500]}..."))
-            return False
-        except Exception as e:
-            msg_queue.put(("log", f"An unexpected error occurred while downloading '{artist} - {name}': {e}"))
-            return False
+    def cancel_download(self):
+        if self.run_active:
+            self.engine.cancel_event.set()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.update_status("Cancelling... (waiting for active downloads to finish)")
+            self.log_message("Cancellation requested. Pending tracks and queued runs will be skipped.")
 
     def open_last_download_folder(self):
         if self.last_download_path and os.path.isdir(self.last_download_path):
@@ -457,7 +465,7 @@ if __name__ == "__main__":
     print("Starting script...")
 
     # Load existing .env if present
-    load_dotenv(dotenv_path=ENV_FILE)
+    load_environment()
     print("Environment variables loaded.")
 
     # Check credentials
@@ -473,7 +481,7 @@ if __name__ == "__main__":
             print("User did not provide valid credentials or closed the prompt. Exiting.")
             exit(1)
         print("Credentials saved. Reloading environment variables.")
-        load_dotenv(dotenv_path=ENV_FILE, override=True)
+        load_environment(override=True)
         final_client_id = os.getenv("CLIENT_ID")
         final_client_secret = os.getenv("CLIENT_SECRET")
         if not is_valid_credential(final_client_id) or not is_valid_credential(final_client_secret):
@@ -487,8 +495,8 @@ if __name__ == "__main__":
     print("Starting main application...")
     root = tk.Tk()  # Create the main app root window only now
     app = SpotifyDownloaderGUI(root)
-    if hasattr(app, 'sp') and app.sp:
+    if hasattr(app, 'engine'):
         root.mainloop()
     else:
-        print("Application initialization failed (likely Spotify auth). Exiting.")
+        print("Application initialization failed (invalid credentials). Exiting.")
         root.destroy()
\ No newline at end of file